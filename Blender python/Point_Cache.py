@@ -0,0 +1,31 @@
+"""
+Point_Cache
+
+.pc2 point cache files, played by the Mesh Cache modifier of Blender :
+the vertices of a mesh at every frame. Shared by the Traffic Jam
+Simulator (instanced cars) and the multiplication by modulo graphs
+(multiplier sweep). Runs without Blender (numpy only)
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+"""
+
+import numpy as np
+
+
+# Write frames of vertices into a .pc2 point cache (Mesh Cache modifier)
+# frames : iterable of FrameCount arrays of PointCount vertices, written
+# one after the other (only one in memory)
+def write_pc2(file_path, frames, FrameCount, PointCount, StartFrame=1):
+    header = np.zeros(1, dtype=[('magic', 'S12'), ('version', '<i4'),
+                                ('points', '<i4'), ('start', '<f4'),
+                                ('rate', '<f4'), ('samples', '<i4')])
+    header[0] = (b'POINTCACHE2', 1, PointCount, StartFrame, 1, FrameCount)
+    with open(file_path, 'wb') as file:
+        file.write(header.tobytes())
+        for verts in frames:
+            file.write(np.ascontiguousarray(verts, dtype='<f4').tobytes())
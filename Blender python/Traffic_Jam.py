@@ -1,7 +1,10 @@
 import bpy
 import numpy as np
 import math
-import random
+import os
+import sys
+import importlib
+import mathutils
 
 # ********************************************************************
 # Traffic Jam Simulator
@@ -13,32 +16,88 @@ import random
 # Licence used = Creative Commons CC BY
 # Check licence here : https://creativecommons.org
 #
+# The simulation itself lives in Traffic_Jam_Sim.py (no bpy), keep it
+# next to this script. It can also run headless and write a trajectory
+# file, replayed here with TrajectoryFile. The point cache of InstanceMode
+# is written by Point_Cache.py, keep it next to this script too.
+#
 # Master variables :
 #   SegCount = Mean the number of segments, one segment must be empty
 #              or containing a car
-#   LaneCount = Mean the number of Lane. This code is designed for 1 lane only
+#   LaneCount = Mean the number of Lane. Cars overtake on the next lane
+#               and come back when the road is free
+#   RoadNetwork = Name of a curve object : cars drive on a network of roads
+#                 instead of the circle road (see Traffic_Jam_Network.py)
+#                 Every spline is a one way road (in its direction), ends
+#                 of splines at the same place are junctions and the
+#                 material index of a spline is the priority of its road
+#                 '' for the circle road
 #   CarCount = Mean the number of cars
+#   Vectorized = True move all cars at once with numpy (fast, for big roads)
+#                False sequential per-car update (same rules, slower). It
+#                does not give the results of the original script
+#   TickTime = Simulated seconds by tick. Speed rules apply once by second,
+#              longer ticks are computed in sub-steps (faster, less exact)
+#   FrameRate, SpeedUp = Frames by second of the render and simulated
+#              seconds by second of video. Keyframes are put at the time of
+#              ticks (between frames too) and F-curves interpolate the
+#              frames, so any frame rate comes from one simulation
+#   BakeMode = True fill F-curve buffers as the simulation runs, then bake
+#              all F-curves at once
+#              False insert keyframes tick by tick (original behavior)
+#   BrakeLights = True stop lights (material Mat_Idx_SL_Off of the model)
+#                 light up when a car brakes, from one 'brake' value by car
+#   Decimate = '' bake one keyframe by tick
+#              'BEZIER' or 'LINEAR' drop keyframes this interpolation
+#              reproduces within KeyTolerance (fraction of a segment,
+#              KeyRotTolerance in radians)
+#   TrajectoryFile = .npz file written by Traffic_Jam_Sim.py to replay
+#                    '' to simulate here
+#   CheckpointFile = state of the simulation saved every CheckpointTicks
+#                    ticks. When it exists (same master variables) the
+#                    simulation continue from it. '' for none. The cars
+#                    baked so far are in CheckpointFile + '.bake'
+#   Profiling = True print named timers and counters at the end (also
+#               with the environment variable TRAFFIC_JAM_PROFILE=1 or
+#               TRAFFIC_JAM_PROFILE=file.json to write them)
+#   InstanceMode = True all cars (but SlowCar) are instances of the car
+#                  model, on the vertices of one object (Blender 3.2+)
+#                  moved by a Mesh Cache modifier playing InstanceFile
+#                  False one object and one mesh copy by car
+#   InstanceFile = .pc2 point cache written for InstanceMode (two vertices
+#                  by car and by tick), relative to the .blend with '//'
+#                  (save it first). Keep it with the .blend for farms
 # ********************************************************************
 
+# Find Traffic_Jam_Sim.py next to this script (or next to the .blend file)
+for script_dir in (os.path.dirname(os.path.abspath(__file__)),
+                   os.path.dirname(bpy.data.filepath)):
+    if os.path.isfile(os.path.join(script_dir, 'Traffic_Jam_Sim.py')):
+        if script_dir not in sys.path:
+            sys.path.append(script_dir)
+        break
+import Traffic_Jam_Sim
+import Traffic_Jam_Network
+import Point_Cache
+importlib.reload(Traffic_Jam_Sim)  # take edits into account between runs
+importlib.reload(Traffic_Jam_Network)
+importlib.reload(Point_Cache)
+profiler = Traffic_Jam_Sim.profiler
+
 # Design the Road
 # The segment represent place to put one car (SizeCarX) or nothing
 SegCount = 500
 LaneCount = 1  # Must be a pure divider of SegCount
-Road_Segments = np.zeros(((LaneCount + 1), (SegCount + 1)), dtype=int)
-
-# Coef (divide by) for interpolate the road to screen
-# Cars touching
-CoefBlender = SegCount / 50
+# Or a network of roads (curve object), SegLength units by segment
+RoadNetwork = ''
+SegLength = 5
 
 # Design the car
 # 5 meters / 2,5 meters (x,y)
 # You can use everything you want
 obj_Model_Name = 'Car_Model'
-SizeCarX = 5  # mean also the size of one segment
+SizeCarX = Traffic_Jam_Sim.SizeCarX  # mean also the size of one segment
 SizeCarY = 2.5
-SizeOfRoad = SegCount * SizeCarX
-# transform speed in km/h into segment unit in second
-CoefSpeed = 1 / 3600 * 1000 / SizeCarX
 
 # in Km/h
 SpeedWish = 130
@@ -46,12 +105,36 @@ SpeedWish = 130
 # Material Index StopLight
 Mat_Idx_SL_Off = 1
 Mat_Idx_SL_On = 5
+# Light stop lights of braking cars ('brake' value read by the material)
+BrakeLights = True
 
 CarCount = 32
-# I know, I can use multidimmensionnal array but I won't
-Car_Pos = np.zeros(((CarCount + 1), 3), dtype=int)  # 1 - lane, 2 - segment
-Car_Rot = np.zeros((CarCount + 1), dtype=int)  # For managing rotations
-Car_Speed = np.zeros((CarCount + 1), dtype=int)  # Speed in Km/h
+# The car slowing down between 20 s and 40 s (and highlighted)
+SlowCar = 10
+# Move all cars in one set of numpy operations
+Vectorized = True
+# Bake F-curves in bulk at the end of the run
+BakeMode = True
+# Number of simulation ticks, of TickTime simulated seconds
+TickCount = 400
+TickTime = 1
+# Render frame rate and simulated seconds by second of video
+FrameRate = 24
+SpeedUp = 4
+# Drop keyframes the interpolation can reproduce ('', 'BEZIER', 'LINEAR')
+Decimate = ''
+KeyTolerance = 0.01  # of a segment
+KeyRotTolerance = 0.001
+# Replay a trajectory recorded headless instead of simulating
+TrajectoryFile = ''
+# Save the simulation as it goes, to continue it after a crash
+CheckpointFile = ''
+CheckpointTicks = 100
+# Instance the car model on points instead of copying its mesh by car
+InstanceMode = False
+InstanceFile = '//Traffic_Jam_Cars.pc2'
+# Time simulation, objects lookup and keyframing
+Profiling = False
 
 
 # Research about a collection
@@ -80,123 +163,582 @@ def assign_to_collection(collect, ob):
     collect.objects.link(ob)
 
 
-# Initial State
 # Create the number of cars choosing (by duplicating the car model)
-# And place them belong the lanes of the road
-def initial_state(collect):
-    # Design the road
-
-    # Dispatch cars on the road
-    # For sample here we use the dispatch fair
-    # Same amount of car by lane
-
-    # Init the road
-    for lane in range(1, LaneCount + 1):
-        for segment in range(1, SegCount + 1):
-            Road_Segments[lane, segment] = 0
-
-    # Init car on the road
-    CarCountByLane = (CarCount + 1) / LaneCount
-    CarSpaceByLane = (SegCount + 1) / CarCountByLane
-    TotalSegment = LaneCount * SegCount
-    for car in range(1, CarCount + 1):
-        lane = round((CarSpaceByLane * car)) // SegCount + 1
-        segment = round((CarSpaceByLane * car)) % SegCount
-        Road_Segments[lane, segment] = car
-        Car_Pos[car, 1] = lane
-        Car_Pos[car, 2] = segment
-
-    # Design all cars
-    for car in range(1, CarCount + 1):
+# Only the cars listed in cars are created when given
+# return the Blender objects of the cars indexed by car (None if not created)
+def create_cars(collect, CarCount, cars=None):
+    Car_Objects = [None] * (CarCount + 1)
+    if cars is None:
+        cars = range(1, CarCount + 1)
+    for car in cars:
         # Reproduce Model
         obj_Name = 'Car_' + str(car)
-        ob = bpy.data.objects[obj_Model_Name]
+        with profiler.timer('lookup'):
+            ob = bpy.data.objects[obj_Model_Name]
         new_ob = bpy.data.objects.new(obj_Model_Name, ob.data.copy())
         assign_to_collection(collect, new_ob)
         new_ob.name = obj_Name
         new_ob.scale = 2.0, 2.0, 2.0
-        if car == 10:
+        Car_Objects[car] = new_ob
+        if car == SlowCar:
+            # Highlight it : material 2 become 6, on all faces at once
             mesh = new_ob.data
-            for f in mesh.polygons:  # iterate over faces
-                if f.material_index == 2:
-                    f.material_index = 6
-                    f.keyframe_insert('material_index')
-
-
-# Redraw all car at their respectives positions
-def redraw_car(scn):
-    z = 1.2
-    rx = math.radians(90)
-    ry = 0
+            indexes = np.zeros(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get('material_index', indexes)
+            indexes[indexes == 2] = 6
+            mesh.polygons.foreach_set('material_index', indexes)
+    return Car_Objects
+
+
+# Compute location and rotation of cars at once, from their lane,
+# segment and laps (any shape of arrays, (tick, car) for a trajectory)
+# return x, y, rot
+def car_transforms(lane, segment, laps, SegCount):
+    # Coef (divide by) for interpolate the road to screen
+    # Cars touching
+    CoefBlender = SegCount / 50
+    SizeOfRoad = SegCount * SizeCarX
     theta = math.radians(360)  # 2Pi
     alpha = theta / SegCount
-    for car in range(1, CarCount + 1):
-        obj_Name = 'Car_' + str(car)
-        ob = bpy.data.objects[obj_Name]
-
-        # Place it
-        lane = Car_Pos[car, 1]
-        segment = Car_Pos[car, 2]
-        angle = segment * alpha
-
-        x = (SizeOfRoad * math.cos(angle) / CoefBlender) * (1 + (lane / 19))
-        y = (SizeOfRoad * math.sin(angle) / CoefBlender) * (1 + (lane / 19))
-
-        rot = math.radians(math.degrees(angle) + (360 * Car_Rot[car]) - 90)
-
-        ob.location = (x, y, z)
-        ob.keyframe_insert('location')
-        ob.rotation_euler = (rx, ry, rot)
-        ob.keyframe_insert('rotation_euler')
-
-
-# Give space between car and car in front of
-# reel space + freed space by supposed car in front speed
-# return space_IFO in segment unit
-def get_space_IFO(car) -> int:
-    curlane = Car_Pos[car, 1]
-    curseg = Car_Pos[car, 2]
-    space_IFO = 0
-    while 1 == 1:
-        curseg += 1
-        space_IFO += 1
-        if curseg > SegCount:
-            curseg = 1
-        if (Road_Segments[curlane, curseg] != 0):
-            Car_IFO = Road_Segments[curlane, curseg]
-            Speed_Car_IFO = Car_Speed[Car_IFO]
-            break
-    return space_IFO
-
-
-# calculate the new speed for a car
-def new_speed(car, space_IFO) -> int:
-    # Search the speed limit to preserve speed objective and security distance
-    Speed = Car_Speed[car]
-
-    # if speed < wish speed then attempt to accelerate a bit (10 percents)
-    if (Speed < SpeedWish):
-        if Speed == 0:
-            Speed = SpeedWish // 10
+    angle = segment * alpha
+
+    x = (SizeOfRoad * np.cos(angle) / CoefBlender) * (1 + (lane / 19))
+    y = (SizeOfRoad * np.sin(angle) / CoefBlender) * (1 + (lane / 19))
+
+    # laps are counted, rotation keep growing along the circle
+    rot = angle + math.radians(360) * laps - math.radians(90)
+    return x, y, rot
+
+
+# Length of one segment on screen, on the circle road (middle of the
+# first lane, as car_transforms) or on the network
+# info : trajectory info of the simulation (trajectory_info)
+def segment_size(info):
+    if 'SegLength' in info:
+        return float(info['SegLength'])
+    return 2 * math.pi * 50 * SizeCarX / float(info['SegCount'])
+
+
+# Compute location and rotation of cars at once, for some ticks of the
+# trajectory (all by default), on the circle road or on the network
+# The model is turned as on the circle (heading - 180 degrees) and the
+# rotation is unwrapped over ticks, so it never jump
+# return x, y, z, rot
+def traj_transforms(traj, ticks=slice(None)):
+    if Network is None:
+        x, y, rot = car_transforms(traj['lane'][ticks],
+                                   traj['segment'][ticks],
+                                   traj['laps'][ticks], traj['SegCount'])
+        return x, y, np.full(np.shape(x), 1.2), rot
+    x, y, z, heading = Network.positions(traj['edge'][ticks],
+                                         traj['segment'][ticks])
+    rot = heading - math.radians(180)
+    if rot.ndim > 1:
+        rot = np.unwrap(rot, axis=0)
+    return x, y, z + 1.2, rot
+
+
+# Sample the splines of a curve object as roads (world coordinates)
+# Bezier splines are sampled at their resolution
+# return polylines and priorities (material index of the splines)
+def network_polylines(ob):
+    matrix = ob.matrix_world
+    polylines = []
+    priorities = []
+    for spline in ob.data.splines:
+        if spline.type == 'BEZIER':
+            knots = list(spline.bezier_points)
+            if spline.use_cyclic_u:
+                knots.append(knots[0])
+            points = [knots[0].co]
+            for k0, k1 in zip(knots[:-1], knots[1:]):
+                points += mathutils.geometry.interpolate_bezier(
+                    k0.co, k0.handle_right, k1.handle_left, k1.co,
+                    spline.resolution_u + 1)[1:]
+        else:
+            points = [p.co.xyz for p in spline.points]
+            if spline.use_cyclic_u:
+                points.append(points[0])
+        polylines.append([tuple(matrix @ co) for co in points])
+        priorities.append(spline.material_index)
+    return polylines, priorities
+
+
+# Brake lights state of cars (1.0 on, 0.0 off) from their speeds by tick
+# A car brakes when its speed goes down, and stay lit while stopped
+def brake_lights(speed):
+    brake = np.zeros(speed.shape, dtype=np.float32)
+    brake[1:] = (speed[1:] < speed[:-1]) | (speed[1:] == 0)
+    return brake
+
+
+# Redraw all car at their respectives positions for one tick
+# transforms : x, y, z, rot of the trajectory (traj_transforms)
+# brake : brake lights of the trajectory (brake_lights)
+# Keys are put at frame (may be between two frames)
+def redraw_car(scn, Car_Objects, transforms, brake, tick, frame):
+    rx = math.radians(90)
+    ry = 0
+    x, y, z, rot = [values[tick] for values in transforms]
+    for car in range(1, len(Car_Objects)):
+        ob = Car_Objects[car]
+        if ob is None:
+            continue
+        ob.location = (x[car], y[car], z[car])
+        ob.keyframe_insert('location', frame=frame)
+        ob.rotation_euler = (rx, ry, rot[car])
+        ob.keyframe_insert('rotation_euler', frame=frame)
+        if BrakeLights:
+            ob['brake'] = float(brake[tick, car])
+            ob.keyframe_insert('["brake"]', frame=frame)
+
+
+# Slopes (value by frame) before and after every tick of curves sampled
+# at frames : cars keep their speed between two ticks
+# values : (tick) for one curve or (tick, curve) for all curves at once
+# return left and right slopes, same shape as values
+def one_sided_slopes(frames, values):
+    step = np.diff(frames).reshape((-1,) + (1,) * (values.ndim - 1))
+    slopes = np.diff(values, axis=0) / step
+    return np.r_[slopes[:1], slopes], np.r_[slopes, slopes[-1:]]
+
+
+# Slopes of the curves of cars on both sides of every tick, for Bezier
+# handles. x and y follow the heading of the car (rot + 180 degrees) at
+# the speed of the tick before or after, so a car keeping its speed is
+# followed along its road and a change of speed is a corner, not smeared
+# over the ticks around (as central differences do)
+# transforms : x, y, z, rot (tick, car) as traj_transforms
+# return (left, right) slopes of x, y, z and rot
+def key_tangents(frames, transforms):
+    x, y, z, rot = transforms
+    step = np.diff(frames)[:, None]
+    speed = np.hypot(np.diff(x, axis=0), np.diff(y, axis=0)) / step
+    before, after = np.r_[speed[:1], speed], np.r_[speed, speed[-1:]]
+    cos = -np.cos(rot)
+    sin = -np.sin(rot)
+    return [(cos * before, cos * after), (sin * before, sin * after),
+            one_sided_slopes(frames, z), one_sided_slopes(frames, rot)]
+
+
+# Keyframes to keep so that the interpolation between kept keyframes
+# reproduces every sample within tolerance (greedy, all curves at once)
+# With tangents (left and right slopes), Bezier keyframes whose handles
+# follow them (cubic Hermite), else linear. A kept keyframe is never more than
+# MaxSpan ticks after the previous one.
+# values : (tick) for one curve or (tick, curve) for all curves at once
+# return the mask of kept keyframes, same shape as values
+def decimate_keys(frames, values, tolerance, tangents=None, MaxSpan=32):
+    n = len(frames)
+    v = values.reshape(n, -1)
+    if tangents is not None:
+        left, right = [m.reshape(n, -1) for m in tangents]
+    curves = np.arange(v.shape[1])
+    keep = np.zeros(v.shape, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    last = np.zeros(v.shape[1], dtype=int)  # last kept tick by curve
+
+    for i in range(1, n - 1):
+        # Without keyframe at i, can last -> i + 1 still reproduce the
+        # samples between them ?
+        b = i + 1
+        ok = (b - last) <= MaxSpan
+        fa = frames[last]
+        h = frames[b] - fa
+        va = v[last, curves]
+        vb = v[b]
+        for d in range(1, b - last.min()):
+            j = last + d
+            test = ok & (j < b)
+            if not test.any():
+                break
+            j = np.minimum(j, b)
+            s = (frames[j] - fa) / h
+            if tangents is None:
+                guess = va + (vb - va) * s
+            else:
+                s2 = s * s
+                s3 = s2 * s
+                guess = (2 * s3 - 3 * s2 + 1) * va \
+                    + (s3 - 2 * s2 + s) * h * right[last, curves] \
+                    + (-2 * s3 + 3 * s2) * vb \
+                    + (s3 - s2) * h * left[b]
+            ok &= ~(test & (np.abs(guess - v[j, curves]) > tolerance))
+        keep[i, ~ok] = True
+        last[~ok] = i
+    return keep.reshape(values.shape)
+
+
+# Create one F-curve and fill all its keyframes in one call
+# With tangents (left and right slopes), keyframes are Bezier with free
+# handles along them, with interpolation 'LINEAR' or 'CONSTANT',
+# keyframes are linear or steps
+def bake_fcurve(action, data_path, index, frames, values, tangents=None,
+                interpolation='BEZIER'):
+    count = len(frames)
+    fc = action.fcurves.new(data_path, index=index)
+    fc.keyframe_points.add(count)
+    co = np.empty((2 * count), dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    points = fc.keyframe_points
+    points.foreach_set('co', co)
+    if interpolation == 'CONSTANT':
+        points.foreach_set('interpolation', np.zeros(count, dtype=np.int32))
+    elif interpolation == 'LINEAR':
+        points.foreach_set('interpolation', np.ones(count, dtype=np.int32))
+    elif tangents is not None and count > 1:
+        # Handles at a third of the way to the previous and next keyframes
+        before = np.diff(frames, prepend=2 * frames[0] - frames[1]) / 3
+        after = np.diff(frames, append=2 * frames[-1] - frames[-2]) / 3
+        free = np.zeros(count, dtype=np.int32)
+        points.foreach_set('handle_left_type', free)
+        points.foreach_set('handle_right_type', free)
+        handle = np.empty((2 * count), dtype=np.float32)
+        handle[0::2] = frames - before
+        handle[1::2] = values - tangents[0] * before
+        points.foreach_set('handle_left', handle)
+        handle[0::2] = frames + after
+        handle[1::2] = values + tangents[1] * after
+        points.foreach_set('handle_right', handle)
+    fc.update()
+
+
+# Bake the whole trajectory of all cars (BakeMode)
+# location x, y, z and rotation z are animated, rotation x, y are fixed
+# rot keep growing with laps, so it never jump when a car pass segment 0
+# transforms, brake : as redraw_car, for all ticks
+# SegSize : length of one segment on screen (segment_size)
+def bake_cars(Car_Objects, transforms, brake, frames, SegSize):
+    x, y, z, rot = transforms
+    distance = KeyTolerance * SegSize
+    curves = [('location', 0, x, distance),
+              ('location', 1, y, distance),
+              ('location', 2, z, distance),
+              ('rotation_euler', 2, rot, KeyRotTolerance)]
+    all_slopes = key_tangents(frames, transforms) \
+        if Decimate == 'BEZIER' else [None] * 4
+    keeps = []
+    tangents = []
+    for (data_path, index, values, tolerance), slopes in \
+            zip(curves, all_slopes):
+        if Decimate:
+            keeps.append(decimate_keys(frames, values, tolerance, slopes))
+            tangents.append(slopes)
         else:
-            Speed = Speed + round(Speed * 0.10)
-        if (Speed > SpeedWish):
-            Speed = SpeedWish
-
-    # and now check if the speed choosen is acceptable for security reason
-    # if not, adapt it
-    space_IFO = space_IFO * SizeCarX  # set space_IFO in meters
-    Secure_Dist = (Speed * 0.55) * 1.35
-    quantum = round(Speed * 0.10)
-    while space_IFO < Secure_Dist:
-        # Slow down a bit (10 percents)
-        Speed = Speed - quantum
-        Secure_Dist = (Speed * 0.55) * 1.35
-        # In case of full stop
-        if (Speed < 0):
-            Speed = 0
-            break
-    return Speed  # km/h
+            keeps.append(None)
+            tangents.append(None)
+
+    for car in range(1, len(Car_Objects)):
+        ob = Car_Objects[car]
+        if ob is None:
+            continue
+        ob.rotation_euler = (math.radians(90), 0, 0)
+        ob.animation_data_create()
+        action = bpy.data.actions.new(ob.name + 'Action')
+        ob.animation_data.action = action
+        for (data_path, index, values, tolerance), keep, slopes in \
+                zip(curves, keeps, tangents):
+            if keep is None:
+                bake_fcurve(action, data_path, index, frames, values[:, car])
+                continue
+            kept = keep[:, car]
+            bake_fcurve(action, data_path, index, frames[kept],
+                        values[kept, car],
+                        None if slopes is None
+                        else [m[kept, car] for m in slopes],
+                        'LINEAR' if slopes is None else 'BEZIER')
+        if BrakeLights:
+            # One step keyframe each time the brake lights change
+            lights = brake[:, car]
+            kept = np.r_[True, lights[1:] != lights[:-1]]
+            ob['brake'] = 0.0
+            bake_fcurve(action, '["brake"]', 0, frames[kept], lights[kept],
+                        interpolation='CONSTANT')
+
+
+# Consumer baking the cars of a simulation (or of a replay) as ticks come
+# Ticks are turned into transforms and brake lights by chunks of
+# ChunkTicks ticks, the trajectory itself is never kept. Transforms fill
+# the F-curve buffers (float32, tick by car) : with BakeMode they are
+# baked at close (foreach_set fills a whole F-curve at once), else
+# keyframes are inserted chunk by chunk. The buffers stay after close
+# (points of InstanceMode)
+# With file_path, the buffers are mapped on this file : a checkpoint
+# only writes the ticks baked since the previous one, and saves their
+# count and the shape of the buffers (checkpoints need it). A resumed run
+# needs the same file, of the same shape, or it would bake cars at 0 :
+# with resume the file is never created again, a missing one is an error
+class CarBaker:
+    def __init__(self, Car_Objects, sim, TickCount, frames, ChunkTicks=100,
+                 file_path=None, resume=False):
+        self.Car_Objects = Car_Objects
+        self.info = sim.trajectory_info()
+        self.frames = frames
+        self.rows = {field: np.zeros((ChunkTicks, (sim.CarCount + 1)),
+                                     dtype=dtype)
+                     for field, dtype in sim.Fields.items()}
+        # x, y, z, rot then brake lights
+        shape = (5, TickCount, (sim.CarCount + 1))
+        # mapped : the ticks baked before are in the buffers (existing file)
+        self.file_path = file_path
+        self.mapped = False
+        if file_path is None:
+            self.buffers = np.zeros(shape, dtype=np.float32)
+        else:
+            # Kept when it fits, a resumed run restore its count
+            size = np.prod(shape) * np.dtype(np.float32).itemsize
+            self.mapped = os.path.isfile(file_path) \
+                and os.path.getsize(file_path) == size
+            if resume and not self.mapped:
+                raise ValueError(self.missing())
+            self.buffers = np.memmap(file_path, dtype=np.float32,
+                                     mode='r+' if self.mapped else 'w+',
+                                     shape=shape)
+        self.transforms = list(self.buffers[:4])
+        self.brake = self.buffers[4]
+        self.speed = None  # speeds of the last tick baked
+        self.size = 0  # ticks waiting in rows
+        self.count = 0  # ticks baked
+
+    def consume(self, sim):
+        for field, row in sim.rows().items():
+            self.rows[field][self.size] = row
+        self.size += 1
+        if self.size == len(self.rows['speed']):
+            self.flush()
+
+    # Transforms and brake lights of the waiting ticks
+    def flush(self):
+        if self.size == 0:
+            return
+        with profiler.timer('keyframing'):
+            chunk = {field: rows[:self.size]
+                     for field, rows in self.rows.items()}
+            chunk.update(self.info)
+            start = self.count
+            self.count += self.size
+            self.size = 0
+            x, y, z, rot = traj_transforms(chunk)
+            speed = chunk['speed']
+            if self.speed is not None:
+                # Rotation and brake lights follow the previous tick
+                rot = np.unwrap(np.vstack((self.transforms[3][start - 1],
+                                           rot)), axis=0)[1:]
+                speed = np.vstack((self.speed, speed))
+            brake = brake_lights(speed)[len(speed) - len(rot):]
+            for buffer, values in zip(self.transforms, (x, y, z, rot)):
+                buffer[start:self.count] = values
+            self.brake[start:self.count] = brake
+            self.speed = speed[-1].copy()
+            if not BakeMode:
+                self.redraw(start, self.count)
+
+    # Insert keyframes of ticks start to stop (excluded)
+    def redraw(self, start, stop):
+        for t in range(start, stop):
+            redraw_car(bpy.context.scene, self.Car_Objects, self.transforms,
+                       self.brake, t, self.frames[t])
+
+    def close(self):
+        self.flush()
+        self.transforms = [values[:self.count] for values in self.transforms]
+        self.brake = self.brake[:self.count]
+        if BakeMode:
+            with profiler.timer('keyframing'):
+                bake_cars(self.Car_Objects, self.transforms, self.brake,
+                          self.frames[:self.count], segment_size(self.info))
+
+    # Ticks baked so far (in the mapped file), for a checkpoint, and back
+    def checkpoint(self):
+        self.flush()
+        self.buffers.flush()
+        state = {'count': np.array(self.count),
+                 'shape': np.array(self.buffers.shape)}
+        if self.speed is not None:
+            state['speed'] = self.speed
+        return state
+
+    # Error of a resumed run without the ticks baked before
+    def missing(self):
+        return ('Baked cars of the checkpoint are missing or of another size'
+                ' (%s), delete the checkpoint to start again' % self.file_path)
+
+    def restore(self, state):
+        shape = tuple(int(n) for n in state.get('shape', ()))
+        if shape != self.buffers.shape:
+            raise ValueError('Checkpoint bake buffers have shape %s, not %s'
+                             ' (TickCount changed ?)'
+                             % (shape, self.buffers.shape))
+        if not self.mapped:
+            raise ValueError(self.missing())
+        self.count = int(state['count'])
+        self.speed = state.get('speed')
+        self.size = 0
+        if not BakeMode:
+            self.redraw(0, self.count)
+
+
+# Geometry nodes putting one instance of the car model on every even
+# vertex. The next vertex is one unit ahead of the car (heading) and
+# brake units above it : rotation and 'brake' come from their difference
+def instances_node_group():
+    ng = bpy.data.node_groups.new('Cars_Instances', 'GeometryNodeTree')
+    if bpy.app.version >= (4, 0, 0):
+        ng.interface.new_socket('Geometry', in_out='INPUT',
+                                socket_type='NodeSocketGeometry')
+        ng.interface.new_socket('Geometry', in_out='OUTPUT',
+                                socket_type='NodeSocketGeometry')
+    else:
+        ng.inputs.new('NodeSocketGeometry', 'Geometry')
+        ng.outputs.new('NodeSocketGeometry', 'Geometry')
+    nodes = ng.nodes
+    links = ng.links
+    group_in = nodes.new('NodeGroupInput')
+    group_out = nodes.new('NodeGroupOutput')
+
+    # Socket of the current data type (some nodes have one by type)
+    def socket(sockets, name):
+        return [s for s in sockets if s.name == name and s.enabled][0]
+
+    # Output of a math (or vector math) node on a, b (socket or number)
+    def operate(operation, a, b=None, vector=False):
+        node = nodes.new('ShaderNodeVectorMath' if vector
+                         else 'ShaderNodeMath')
+        node.operation = operation
+        links.new(a, node.inputs[0])
+        if isinstance(b, float):
+            node.inputs[1].default_value = b
+        elif b is not None:
+            links.new(b, node.inputs[1])
+        return node.outputs[0]
+
+    # Vector from the car to the next vertex
+    index = nodes.new('GeometryNodeInputIndex').outputs[0]
+    position = nodes.new('GeometryNodeInputPosition').outputs[0]
+    ahead = nodes.new('GeometryNodeFieldAtIndex')
+    ahead.domain = 'POINT'
+    ahead.data_type = 'FLOAT_VECTOR'
+    links.new(operate('ADD', index, 1.0), ahead.inputs['Index'])
+    links.new(position, socket(ahead.inputs, 'Value'))
+    heading = nodes.new('ShaderNodeSeparateXYZ')
+    links.new(operate('SUBTRACT', socket(ahead.outputs, 'Value'), position,
+                      vector=True), heading.inputs[0])
+
+    rotation = nodes.new('ShaderNodeCombineXYZ')
+    rotation.inputs['X'].default_value = math.radians(90)
+    links.new(operate('ARCTAN2', heading.outputs['Y'], heading.outputs['X']),
+              rotation.inputs['Z'])
+
+    brake = nodes.new('GeometryNodeStoreNamedAttribute')
+    brake.data_type = 'FLOAT'
+    brake.domain = 'POINT'
+    brake.inputs['Name'].default_value = 'brake'
+    links.new(group_in.outputs[0], brake.inputs['Geometry'])
+    links.new(heading.outputs['Z'], socket(brake.inputs, 'Value'))
+
+    model = nodes.new('GeometryNodeObjectInfo')
+    model.inputs['Object'].default_value = bpy.data.objects[obj_Model_Name]
+    instance = nodes.new('GeometryNodeInstanceOnPoints')
+    instance.inputs['Scale'].default_value = (2.0, 2.0, 2.0)
+    links.new(brake.outputs['Geometry'], instance.inputs['Points'])
+    links.new(operate('LESS_THAN', operate('MODULO', index, 2.0), 0.5),
+              instance.inputs['Selection'])
+    links.new(model.outputs['Geometry'], instance.inputs['Instance'])
+    links.new(rotation.outputs[0], instance.inputs['Rotation'])
+    links.new(instance.outputs['Instances'], group_out.inputs[0])
+    return ng
+
+
+# Vertices of instanced cars for one tick : the car, then one unit ahead
+# of it and brake units above (see instances_node_group)
+# transforms, brake : as redraw_car for one tick, of the instanced cars
+def instance_vertices(transforms, brake):
+    x, y, z, rot = transforms
+    co = np.empty((len(x), 2, 3), dtype=np.float32)
+    co[:, 0, 0] = x
+    co[:, 0, 1] = y
+    co[:, 0, 2] = z
+    co[:, 1, 0] = x + np.cos(rot)
+    co[:, 1, 1] = y + np.sin(rot)
+    co[:, 1, 2] = z + brake
+    return co.reshape(-1, 3)
+
+
+# Create the object holding the vertices of instanced cars (InstanceMode)
+# Two vertices by car, moved by a Mesh Cache modifier playing the point
+# cache file_path (one sample by tick, written here) : scene evaluation
+# only reads the two samples around the frame
+# transforms, brake : as redraw_car, for all ticks
+# The modifier keeps file_path as given : '//' stays relative to the .blend
+def create_instances(collect, cars, transforms, brake, frames, file_path):
+    samples = (instance_vertices([values[t, cars] for values in transforms],
+                                 brake[t, cars])
+               for t in range(len(frames)))
+    Point_Cache.write_pc2(bpy.path.abspath(file_path), samples, len(frames),
+                          2 * len(cars), frames[0])
+
+    mesh = bpy.data.meshes.new('Cars_Points')
+    first = instance_vertices([values[0, cars] for values in transforms],
+                              brake[0, cars])
+    mesh.vertices.add(len(first))
+    mesh.vertices.foreach_set('co', first.ravel())
+    mesh.update()
+    ob = bpy.data.objects.new('Cars_Instances', mesh)
+    collect.objects.link(ob)
+    # Sample of the frame : frame_scale * frame - frame_start
+    step = frames[1] - frames[0] if len(frames) > 1 else 1
+    cache = ob.modifiers.new('Cars_Cache', 'MESH_CACHE')
+    cache.cache_format = 'PC2'
+    cache.filepath = file_path
+    cache.interpolation = 'LINEAR'
+    cache.frame_scale = 1 / step
+    cache.frame_start = frames[0] / step
+    modifier = ob.modifiers.new('Cars_Instances', 'NODES')
+    modifier.node_group = instances_node_group()
+    return ob
+
+
+# Make the stop lights material of the car model light up with 'brake'
+# read from the car object (custom property) or from the instance (point
+# attribute). The lit color is the viewport color of Mat_Idx_SL_On
+def brake_light_material():
+    model = bpy.data.objects[obj_Model_Name]
+    slots = model.material_slots
+    if len(slots) <= max(Mat_Idx_SL_Off, Mat_Idx_SL_On):
+        return
+    mat = slots[Mat_Idx_SL_Off].material
+    if mat is None:
+        return
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    links = mat.node_tree.links
+    if 'Brake_Mix' in nodes:  # already done by a previous run
+        return
+    output = [n for n in nodes if n.type == 'OUTPUT_MATERIAL'][0]
+    if not output.inputs['Surface'].links:
+        return
+    shader_off = output.inputs['Surface'].links[0].from_socket
+
+    brake = nodes.new('ShaderNodeMath')
+    brake.operation = 'MAXIMUM'
+    for index, attribute_type in enumerate(('OBJECT', 'INSTANCER')):
+        attribute = nodes.new('ShaderNodeAttribute')
+        attribute.attribute_type = attribute_type
+        attribute.attribute_name = 'brake'
+        links.new(attribute.outputs['Fac'], brake.inputs[index])
+    light = nodes.new('ShaderNodeEmission')
+    mat_on = slots[Mat_Idx_SL_On].material
+    if mat_on is not None:
+        light.inputs['Color'].default_value = mat_on.diffuse_color
+    light.inputs['Strength'].default_value = 10.0
+    mix = nodes.new('ShaderNodeMixShader')
+    mix.name = 'Brake_Mix'
+    links.new(brake.outputs[0], mix.inputs[0])
+    links.new(shader_off, mix.inputs[1])
+    links.new(light.outputs[0], mix.inputs[2])
+    links.new(mix.outputs[0], output.inputs['Surface'])
 
 
 # ------------------
@@ -205,67 +747,102 @@ def new_speed(car, space_IFO) -> int:
 
 bpy.ops.transform.translate(value=(1, 1, 1))
 
+if Profiling and not profiler.enabled:
+    profiler.enabled = True
+    profiler.setting = '1'
+
 # Create a new collection
 newCol = create_collection("Cars", bpy.context.scene.collection)
 
-# Set the initial state
-initial_state(newCol)
-
-# Set the cars behavior
-# and the default speed
-# speed mean speed in km/h
-for i in range(1, CarCount + 1):
-    Car_Speed[i] = SpeedWish
-
 # ----------
 # Simulation
 # ----------
 
+# Replay a recorded file or simulate here
+# both feed the baker with lane, segment, laps and speed of cars by tick
+Start = 0
+if TrajectoryFile:
+    sim = Traffic_Jam_Sim.TrajectoryReplay(Traffic_Jam_Sim.load_trajectory(
+        bpy.path.abspath(TrajectoryFile)))
+    Ticks = sim.TickCount
+else:
+    # Set the initial state
+    # and the default speed (speed mean speed in km/h)
+    if RoadNetwork:
+        polylines, priorities = network_polylines(
+            bpy.data.objects[RoadNetwork])
+        network = Traffic_Jam_Network.RoadNetwork(polylines, priorities,
+                                                  SegLength=SegLength)
+        sim = Traffic_Jam_Network.TrafficNetwork(network, CarCount=CarCount,
+                                                 SpeedWish=SpeedWish)
+    else:
+        sim = Traffic_Jam_Sim.TrafficSim(SegCount=SegCount,
+                                         LaneCount=LaneCount,
+                                         CarCount=CarCount,
+                                         SpeedWish=SpeedWish,
+                                         Vectorized=Vectorized,
+                                         TickTime=TickTime)
+        sim.SlowCar = SlowCar
+    sim.initial_state()
+    Ticks = TickCount
+
+# Roads of the cars, None on the circle road
+Network = None
+if 'edge' in sim.Fields:
+    Network = Traffic_Jam_Network.trajectory_network(sim.trajectory_info())
+
 # Set animation start
+# Ticks are resampled to the frame rate : one tick every FramesByTick
+# frames (not a whole number of frames in general)
 scn = bpy.context.scene
+scn.render.fps = FrameRate
+scn.render.fps_base = 1
 scn.frame_current = 1
-
-# Draw initial state
-redraw_car(scn)
-
-# 60 here, mean 60 seconds
-for t in range(1, 400):
-    # Animate all individual car with type of behavior
-    # part 1 - for segment position
-    for car in range(1, CarCount + 1):
-        space_IFO = 0
-        curlane = Car_Pos[car, 1]
-        curseg = Car_Pos[car, 2]
-        curspeed = Car_Speed[car]
-
-        # Each Car try to run at maximum speed (speedwish)
-        # Remove car on actual segment
-        Road_Segments[curlane, curseg] = 0
-        # Set the new car segment position
-        space_IFO = get_space_IFO(car)
-        speed = new_speed(car, space_IFO)
-
-        # Slow down one car
-        if (car == 10) and (t > 20 and t < 40):
-            speed = SpeedWish // 6
-
-        Car_Speed[car] = speed
-        Car_Pos[car, 2] += round(speed * CoefSpeed)
-
-        # Assume the road is a circle
-        # and count number of pass to Pos 0 for managing angle
-        if Car_Pos[car, 2] > SegCount:
-            Car_Pos[car, 2] = Car_Pos[car, 2] - SegCount
-            Car_Rot[car] += 1
-        # Set car on new segment
-        Road_Segments[Car_Pos[car, 1], Car_Pos[car, 2]] = car
-
-    # Add 6 frames
-    scn.frame_current += 6
-
-    # Draw initial state
-    redraw_car(scn)
-
+FramesByTick = float(sim.TickTime) * FrameRate / SpeedUp
+Frames = scn.frame_current + FramesByTick * np.arange(Ticks)
+if BrakeLights:
+    brake_light_material()
+
+if InstanceMode:
+    # Checked before simulating : the point cache needs a saved .blend
+    if InstanceFile.startswith('//') and not bpy.data.filepath:
+        raise ValueError('Save the .blend first, InstanceFile %s is'
+                         ' relative to it' % InstanceFile)
+    # Only the highlighted car is a real object (own materials)
+    with profiler.timer('objects'):
+        Car_Objects = create_cars(newCol, sim.CarCount,
+                                  cars=[SlowCar] if SlowCar <= sim.CarCount
+                                  else [])
+    Instanced_Cars = np.array([car for car in range(1, sim.CarCount + 1)
+                               if car != SlowCar], dtype=int)
+else:
+    with profiler.timer('objects'):
+        Car_Objects = create_cars(newCol, sim.CarCount)
+
+# Bake the cars as the simulation goes
+checkpoint_path = ''
+bake_path = None
+if CheckpointFile and not TrajectoryFile:
+    checkpoint_path = bpy.path.abspath(CheckpointFile)
+    bake_path = checkpoint_path + '.bake'
+resuming = bool(checkpoint_path) and os.path.isfile(checkpoint_path)
+baker = CarBaker(Car_Objects, sim, Ticks, Frames, file_path=bake_path,
+                 resume=resuming)
+consumers = [baker]
+if checkpoint_path:
+    if resuming:
+        Start = Traffic_Jam_Sim.resume(checkpoint_path, sim, [baker])
+    consumers.append(Traffic_Jam_Sim.Checkpointer(
+        checkpoint_path, [baker], CheckpointTicks, Start=Start))
+Traffic_Jam_Sim.run(sim, consumers, Ticks, Start=Start)
+
+if InstanceMode:
+    create_instances(newCol, Instanced_Cars, baker.transforms, baker.brake,
+                     Frames, InstanceFile)
+
+scn.frame_current = math.ceil(Frames[-1])
 scn.frame_end = scn.frame_current + 25
 
+profiler.report()
+
 # End of script - Enjoy
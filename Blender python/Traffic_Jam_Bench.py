@@ -0,0 +1,234 @@
+"""
+Traffic_Jam_Bench
+
+Benchmark of the Traffic Jam Simulator (Traffic_Jam_Sim.py) over a matrix
+of CarCount, SegCount and LaneCount, to size render jobs and catch
+performance regressions
+
+Every case is run three times : plain for ticks by second (no phase
+timers, no memory tracing, both slow Python code down), with phase timers
+for the shares of time, with tracemalloc for the peak memory.
+Phases do not overlap : time of a timed method called by another one is
+counted in its own phase only
+
+For every case it reports ticks by second of the simulation alone, the
+seconds of filling F-curves (inside Blender), peak memory of the run
+(numpy arrays included) and the share of time (simulation and F-curves)
+spent in :
+    space => get_space_IFO / get_all_space_IFO (car in front of)
+    speed => new_speed / new_speeds
+    lanes => change_lanes (without the space search it calls)
+    record => trajectory recording (TrajectoryRecorder)
+    fcurves => 4 F-curves by car filled with foreach_set, only when run
+               inside Blender (blender -b --python Traffic_Jam_Bench.py).
+               A proxy of the bake of Traffic_Jam.py : raw trajectory
+               fields, without traj_transforms, decimate_keys nor the
+               handles of bake_fcurve, so less than the real bake cost
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python Traffic_Jam_Bench.py [resultsFile] [tickCount]
+
+    resultsFile => optional CSV file written, one line by case
+    tickCount => number of simulation ticks by case
+"""
+
+import sys
+import os
+import csv
+import time
+import itertools
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Traffic_Jam_Sim
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+# Matrix of cases, every combination is run
+CarCounts = [32, 1000, 10000, 100000]
+SegCounts = [500, 100000, 1000000]
+LaneCounts = [1, 4]
+# Cars moved one by one only up to PerCarMax cars (too slow after)
+PerCarMax = 1000
+# Cases with more than MaxDensity cars by segment are skipped
+MaxDensity = 0.25
+
+Phases = {'space': ('get_space_IFO', 'get_all_space_IFO'),
+          'speed': ('new_speed', 'new_speeds'),
+          'lanes': ('change_lanes',)}
+
+Fields = ['CarCount', 'SegCount', 'LaneCount', 'Vectorized',
+          'ticks_per_s', 'fcurves_s', 'peak_mb', 'space', 'speed', 'lanes',
+          'record', 'fcurves']
+
+
+# Build all cases of the matrix
+def cases():
+    for CarCount, SegCount, LaneCount, Vectorized in itertools.product(
+            CarCounts, SegCounts, LaneCounts, [True, False]):
+        if CarCount > SegCount * LaneCount * MaxDensity:
+            continue
+        if not Vectorized and CarCount > PerCarMax:
+            continue
+        yield CarCount, SegCount, LaneCount, Vectorized
+
+
+# Replace a method of the simulation by the same one adding its
+# duration into timers[phase], less the duration of the timed methods it
+# calls (running : time of nested calls of every running timed method)
+def time_method(sim, name, timers, phase, running):
+    method = getattr(sim, name)
+
+    def timed(*args):
+        running.append(0.0)
+        start = time.perf_counter()
+        result = method(*args)
+        duration = time.perf_counter() - start
+        timers[phase] += duration - running.pop()
+        if running:
+            running[-1] += duration
+        return result
+    setattr(sim, name, timed)
+
+
+# Consumer recording the trajectory and timing it
+class TimedRecorder(Traffic_Jam_Sim.TrajectoryRecorder):
+    def __init__(self, sim, TickCount, timers):
+        super().__init__(sim, TickCount)
+        self.timers = timers
+
+    def consume(self, sim):
+        start = time.perf_counter()
+        super().consume(sim)
+        self.timers['record'] += time.perf_counter() - start
+
+
+# Fill 4 F-curves by car with the raw fields of the recorded trajectory
+# then remove them. Only inside Blender. A proxy of the bake of
+# Traffic_Jam.py (no transforms, decimation nor handles)
+def fill_fcurves(traj):
+    frames = np.arange(len(traj['segment']), dtype=np.float32) * 6 + 1
+    co = np.empty((2 * len(frames)), dtype=np.float32)
+    co[0::2] = frames
+    for car in range(1, int(traj['CarCount']) + 1):
+        action = bpy.data.actions.new('Bench_Car')
+        for data_path, index, field in (('location', 0, 'segment'),
+                                        ('location', 1, 'segment'),
+                                        ('location', 2, 'lane'),
+                                        ('rotation_euler', 2, 'laps')):
+            fc = action.fcurves.new(data_path, index=index)
+            fc.keyframe_points.add(len(frames))
+            co[1::2] = traj[field][:, car]
+            fc.keyframe_points.foreach_set('co', co)
+            fc.update()
+        bpy.data.actions.remove(action)
+
+
+# Run the simulation (and the F-curves inside Blender) of one case
+# Phase timers are added into timers when given
+# return the durations of the simulation and of the F-curves (0 outside
+# Blender)
+def simulate(CarCount, SegCount, LaneCount, Vectorized, tickCount,
+             timers=None):
+    sim = Traffic_Jam_Sim.TrafficSim(SegCount=SegCount, LaneCount=LaneCount,
+                                     CarCount=CarCount, Vectorized=Vectorized)
+    sim.initial_state()
+    if timers is None:
+        recorder = Traffic_Jam_Sim.TrajectoryRecorder(sim, tickCount)
+    else:
+        running = []
+        for phase, names in Phases.items():
+            for name in names:
+                time_method(sim, name, timers, phase, running)
+        recorder = TimedRecorder(sim, tickCount, timers)
+
+    start = time.perf_counter()
+    Traffic_Jam_Sim.run(sim, [recorder], tickCount)
+    duration = time.perf_counter() - start
+    fcurves_duration = 0.0
+    if bpy is not None:
+        start = time.perf_counter()
+        fill_fcurves(recorder.trajectory())
+        fcurves_duration = time.perf_counter() - start
+        if timers is not None:
+            timers['fcurves'] = fcurves_duration
+    return duration, fcurves_duration
+
+
+# Run one case plain, with phase timers, then for its peak memory
+# return the case with its measures
+def run_case(CarCount, SegCount, LaneCount, Vectorized, tickCount):
+    case = (CarCount, SegCount, LaneCount, Vectorized, tickCount)
+    duration, fcurves_duration = simulate(*case)
+
+    timers = {'space': 0.0, 'speed': 0.0, 'lanes': 0.0, 'record': 0.0,
+              'fcurves': 0.0}
+    total = sum(simulate(*case, timers))
+
+    tracemalloc.start()
+    simulate(*case)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {'CarCount': CarCount, 'SegCount': SegCount,
+              'LaneCount': LaneCount, 'Vectorized': Vectorized,
+              'ticks_per_s': round((tickCount - 1) / duration, 1),
+              'fcurves_s': round(fcurves_duration, 3),
+              'peak_mb': round(peak / 2**20, 1)}
+    for phase, value in timers.items():
+        result[phase] = '%.1f%%' % (100 * value / total)
+    if bpy is None:
+        result['fcurves_s'] = '-'
+        result['fcurves'] = '-'
+    return result
+
+
+# Run all cases and print (and write) their measures
+def run_bench(resultsFile, tickCount):
+    print(' '.join('%12s' % field for field in Fields))
+    file = open(resultsFile, 'w', newline='') if resultsFile else None
+    if file:
+        writer = csv.DictWriter(file, fieldnames=Fields)
+        writer.writeheader()
+    for case in cases():
+        result = run_case(*case, tickCount)
+        print(' '.join('%12s' % result[field] for field in Fields))
+        if file:
+            writer.writerow(result)
+            file.flush()
+    if file:
+        file.close()
+
+
+# Main
+if __name__ == "__main__":
+    # Inside Blender, arguments of the script come after '--'
+    if '--' in sys.argv:
+        argv = sys.argv[sys.argv.index('--') + 1:]
+    elif bpy is not None:
+        argv = []
+    else:
+        argv = sys.argv[1:]
+    # Check input parameters
+    if len(argv) > 0:
+        resultsFile = argv[0]
+    else:
+        resultsFile = ''
+    if len(argv) > 1:
+        tickCount = int(argv[1])
+    else:
+        tickCount = 100
+
+    # Call main function with parameters
+    run_bench(resultsFile, tickCount)
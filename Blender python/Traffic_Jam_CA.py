@@ -0,0 +1,209 @@
+"""
+Traffic_Jam_CA
+
+Cellular automaton mode (Nagel-Schreckenberg) of the Traffic Jam Simulator
+for huge rings (10^6 - 10^7 segments), for background traffic
+
+The road occupancy is a bit-packed array (one bit by segment, 64 segments
+by word) and the cars are a compact table (segment, speed, laps) sorted
+along the ring. Each tick, the free space in front of every car is read
+from the bits with word-level operations, then only the words of the
+cars are updated (old bits cleared, new ones set, one xor by word).
+Memory is one bit by segment, a tick works on the cars, not on the road.
+
+Every tick is about 25 numpy passes over the cars, on one core about 300
+ticks/s for 10^6 segments and 10^5 cars, 35 ticks/s for 10^7 segments
+and 10^6 cars. Each pass costs 50 - 300 us at 10^5 cars, so thousands of
+ticks/s at this size would need compiled code, not numpy
+
+Trajectories and checkpoints use the consumers of Traffic_Jam_Sim.py
+(TrajectoryRecorder, TrajectoryWriter, Checkpointer) through run
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python Traffic_Jam_CA.py [segCount] [carCount] [tickCount] [trajectoryFile]
+
+    segCount => number of segments of the ring (one bit each)
+    carCount => number of cars
+    tickCount => number of simulation ticks (one tick = one second)
+    trajectoryFile => optional .npz file (as Traffic_Jam_Sim.py) to replay
+                      with Traffic_Jam.py, keep carCount small for this
+"""
+
+import sys
+import time
+import numpy as np
+
+import Traffic_Jam_Sim
+
+# Size of the words of the occupancy bits
+WordBits = 64
+# Most free space seen in front of a car (segments)
+SpaceMax = WordBits - 8
+
+
+# Rules of Nagel-Schreckenberg on one lane ring
+# Speeds are in segment by tick, VMax must stay under SpaceMax
+class TrafficCA:
+    # Parameters and state for checkpoints (see Traffic_Jam_Sim.resume)
+    Params = ('SegCount', 'CarCount', 'SpeedWish', 'PSlow')
+    StateNames = ('Words', 'Car_Seg', 'Car_Speed', 'Car_Laps', 'tick')
+    # Trajectories are the ones of Traffic_Jam_Sim (see rows)
+    Fields = Traffic_Jam_Sim.TrajectoryFields
+    TickTime = 1
+
+    def __init__(self, SegCount=10**6, CarCount=10**5, SpeedWish=130,
+                 PSlow=0.2, seed=0):
+        self.SegCount = SegCount
+        self.CarCount = CarCount
+        self.SpeedWish = SpeedWish
+        # Same top speed than Traffic_Jam_Sim (segment by tick)
+        self.VMax = round(SpeedWish * Traffic_Jam_Sim.CoefSpeed)
+        # Probability for a car to slow down without reason
+        self.PSlow = PSlow
+        self.SlowDraw = round(PSlow * 65536)
+        self.rng = np.random.default_rng(seed)
+
+        # One bit by segment, the first WordBits segments are mirrored
+        # after the end of the ring, so reading in front never wrap
+        self.Words = np.zeros(((SegCount + WordBits) // WordBits + 2),
+                              dtype=np.uint64)
+        # Cars table, sorted along the ring (cars never overtake)
+        self.Car_Seg = np.zeros(CarCount, dtype=np.uint32)  # 0 to SegCount-1
+        self.Car_Speed = np.zeros(CarCount, dtype=np.uint8)
+        self.Car_Laps = np.zeros(CarCount, dtype=np.uint32)
+        self.tick = 0
+
+    # Cars state for the trajectory fields of Traffic_Jam_Sim (one lane,
+    # segment 1 to SegCount, speed in km/h), index 0 unused
+    def rows(self):
+        speed = np.round(self.Car_Speed / Traffic_Jam_Sim.CoefSpeed)
+        return {'lane': np.ones(self.CarCount + 1, dtype=np.int16),
+                'segment': np.r_[0, self.Car_Seg.astype(np.int64) + 1],
+                'laps': np.r_[0, self.Car_Laps],
+                'speed': np.r_[0, speed]}
+
+    # Parameters written with trajectories
+    def trajectory_info(self):
+        return {'SegCount': np.array(self.SegCount),
+                'LaneCount': np.array(1),
+                'CarCount': np.array(self.CarCount),
+                'SpeedWish': np.array(self.SpeedWish),
+                'TickTime': np.array(self.TickTime)}
+
+    # Toggle occupancy bits of segments given in ring order (sorted but
+    # for one wrap), then copy the first WordBits segments after the end
+    # Bits of one word are next to each other : one xor by word touched
+    def toggle_bits(self, segments):
+        word = segments >> np.uint64(6)
+        masks = np.uint64(1) << (segments & np.uint64(WordBits - 1))
+        starts = np.r_[0, np.flatnonzero(word[1:] != word[:-1]) + 1]
+        values = np.bitwise_xor.reduceat(masks, starts)
+        index = word[starts].astype(np.intp)
+        self.Words[index] ^= values
+        # The wrap can split the first word in two runs, last one applied
+        if len(index) > 1 and index[0] == index[-1]:
+            self.Words[index[0]] ^= values[0]
+
+        tail, offset = divmod(self.SegCount, WordBits)
+        first = self.Words[0]
+        if offset:
+            self.Words[tail] &= np.uint64((1 << offset) - 1)
+            self.Words[tail] |= first << np.uint64(offset)
+            self.Words[tail + 1] = first >> np.uint64(WordBits - offset)
+        else:
+            self.Words[tail] = first
+
+    # Initial State
+    # Cars are placed at same distance on the ring, stopped
+    def initial_state(self):
+        self.Car_Seg[:] = (np.arange(self.CarCount, dtype=np.uint64)
+                           * self.SegCount) // self.CarCount
+        self.Car_Speed[:] = 0
+        self.Car_Laps[:] = 0
+        self.Words[:] = 0
+        self.toggle_bits(self.Car_Seg.astype(np.uint64))
+        self.tick = 0
+
+    # Give free space in front of every car (segment unit) up to
+    # SpaceMax, read as the trailing zeros of the 64 bits starting at the
+    # byte of the segment following the car, shifted to it. Bit SpaceMax
+    # of the window is set, so it is never empty
+    def get_all_space(self):
+        start = self.Car_Seg + np.uint32(1)
+        # Words seen as one uint64 starting at every byte (unaligned)
+        windows = np.ndarray((self.Words.nbytes - 7), dtype='<u8',
+                             buffer=self.Words, strides=(1,))
+        # take is much faster than indexing on unaligned arrays
+        window = windows.take((start >> np.uint32(3)).astype(np.intp))
+        window >>= (start & np.uint32(7)).astype(np.uint64)
+        window |= np.uint64(1 << SpaceMax)
+
+        # Count trailing zeros : lowest bit set, then its exponent read
+        # from the bits of the float64 (powers of 2 are exact)
+        window &= ~window + np.uint64(1)
+        space = window.astype(np.float64).view(np.int64) >> 52
+        return (space - 1023).astype(np.uint8)
+
+    # Move all cars one tick
+    def step(self):
+        self.tick += 1
+        space = self.get_all_space()
+
+        # Accelerate, keep space, slow down randomly (PSlow in 1/65536)
+        speed = np.minimum(self.Car_Speed + np.uint8(1), np.uint8(self.VMax))
+        np.minimum(speed, space, out=speed)
+        draw = np.frombuffer(self.rng.bytes(2 * self.CarCount), dtype='<u2')
+        speed -= (draw < self.SlowDraw) & (speed > 0)
+        self.Car_Speed[:] = speed
+
+        # Move. No car reaches the old place of the car in front, so old
+        # and new places of cars one after the other stay in ring order :
+        # one toggle clears the old bits and sets the new ones (a car
+        # stopped toggles its bit twice)
+        seg = self.Car_Seg + speed
+        lap = seg >= self.SegCount
+        np.subtract(seg, self.SegCount, out=seg, where=lap)
+        places = np.empty(2 * self.CarCount, dtype=np.uint64)
+        places[0::2] = self.Car_Seg
+        places[1::2] = seg
+        self.toggle_bits(places)
+        self.Car_Seg[:] = seg
+        self.Car_Laps += lap
+
+
+# Main
+if __name__ == "__main__":
+    # Check input parameters
+    if len(sys.argv) > 1:
+        segCount = int(sys.argv[1])
+    else:
+        segCount = 10**6
+    if len(sys.argv) > 2:
+        carCount = int(sys.argv[2])
+    else:
+        carCount = segCount // 10
+    if len(sys.argv) > 3:
+        tickCount = int(sys.argv[3])
+    else:
+        tickCount = 1000
+
+    ca = TrafficCA(SegCount=segCount, CarCount=carCount)
+    ca.initial_state()
+    if len(sys.argv) > 4:
+        traj = Traffic_Jam_Sim.record_trajectory(ca, tickCount)
+        Traffic_Jam_Sim.save_trajectory(sys.argv[4], traj)
+    else:
+        start = time.perf_counter()
+        for t in range(tickCount):
+            ca.step()
+        duration = time.perf_counter() - start
+        print('%d ticks/s, mean speed %.1f km/h' % (
+            tickCount / duration,
+            ca.Car_Speed.mean() / Traffic_Jam_Sim.CoefSpeed))
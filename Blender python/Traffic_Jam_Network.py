@@ -0,0 +1,470 @@
+"""
+Traffic_Jam_Network
+
+Road network mode of the Traffic Jam Simulator, for city scale shots
+Roads are the edges of a graph (one lane, one way each) meeting at
+junctions. At the end of its road a car follow the road it has chosen
+(randomly, by weight of the roads leaving the junction).
+
+Junction rules :
+    merge => a car about to enter a road see the last car of this road,
+             as the car in front of it
+    priority => a car approaching a junction yield (stop at the end of
+                its road) when a car of a road with a higher priority
+                approach the same junction and has room on the road it
+                turns to (a car that can't enter never block the
+                junction for the others). When cars of the same
+                priority enter the same road at once, the most advanced
+                one pass, the others wait at the end of their road
+    blocked => a car stopped at the end of its road, in front of a road
+               with no room left, choose again where it goes (drivers
+               going around), so full roads never lock in a loop
+
+Cars of all roads are moved at once with numpy : the occupancy index is
+the list of cars sorted by road then by segment, so the car in front of
+a car is the next one on the same road.
+
+Positions are evaluated along the geometry of the roads (polylines, the
+curves sampled), at the same distance than the segment of the car.
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python Traffic_Jam_Network.py [gridSize] [carCount] [tickCount] [trajectoryFile]
+    python Traffic_Jam_Network.py check
+
+    gridSize => number of junctions by side of a grid of two way streets
+    carCount => number of cars
+    tickCount => number of simulation ticks (one tick = one second)
+    trajectoryFile => optional .npz file to replay with Traffic_Jam.py
+    check => long runs checking that cars never lock (small dense grid,
+             then the default grid)
+"""
+
+import sys
+import time
+import numpy as np
+
+import Traffic_Jam_Sim
+from Traffic_Jam_Sim import SizeCarX, CoefSpeed, profiler
+
+# Cars state written by tick in trajectories, with their types
+NetworkFields = {'edge': np.int32, 'segment': np.int32, 'speed': np.int16}
+
+
+# Group points closer than Tolerance (or linked by such points), by
+# distance : points sorted along an axis are compared to the next ones
+# until they are more than Tolerance away along it. The axis is not x, y
+# or z, so roads in line with them do not make long runs of points
+# return the group of every point (0 to number of groups - 1)
+def merge_points(points, Tolerance):
+    count = len(points)
+    axis = np.array([1.0, 0.7548777, 0.5698403])
+    along = points @ (axis / np.linalg.norm(axis))
+    order = np.argsort(along, kind='stable')
+    sorted_points = points[order]
+    along = along[order]
+    first, second = [], []
+    for k in range(1, count):
+        near = along[k:] - along[:-k] <= Tolerance
+        if not near.any():
+            break
+        near &= np.linalg.norm(sorted_points[k:] - sorted_points[:-k],
+                               axis=1) <= Tolerance
+        index = np.flatnonzero(near)
+        first.append(index)
+        second.append(index + k)
+    first = np.concatenate(first or [np.zeros(0, dtype=int)])
+    second = np.concatenate(second or [np.zeros(0, dtype=int)])
+
+    # Every point takes the smallest label of its group (label propagation)
+    label = np.arange(count)
+    while True:
+        low = np.minimum(label[first], label[second])
+        new = label.copy()
+        np.minimum.at(new, first, low)
+        np.minimum.at(new, second, low)
+        new = new[new]
+        if (new == label).all():
+            break
+        label = new
+    groups = np.empty(count, dtype=int)
+    groups[order] = np.unique(label, return_inverse=True)[1].ravel()
+    return groups
+
+
+# Roads (edges) of a network and the junctions (nodes) where they meet
+# polylines : points (n, 3) of every road, in the direction of the road
+# Road ends closer than Tolerance (or linked by such ends) are the same
+# junction
+# SegLength : length of one segment in units of the points
+class RoadNetwork:
+    def __init__(self, polylines, priorities=None, weights=None,
+                 SegLength=SizeCarX, Tolerance=0.01):
+        EdgeCount = len(polylines)
+        self.EdgeCount = EdgeCount
+        self.SegLength = SegLength
+        if priorities is None:
+            priorities = np.zeros(EdgeCount)
+        if weights is None:
+            weights = np.ones(EdgeCount)
+        self.Edge_Priority = np.asarray(priorities, dtype=int)
+        self.Edge_Weight = np.asarray(weights, dtype=float)
+
+        # Geometry : all points end to end, consecutive duplicates removed
+        points = []
+        for line in polylines:
+            line = np.asarray(line, dtype=float).reshape(-1, 3)
+            step = np.linalg.norm(np.diff(line, axis=0), axis=1)
+            line = line[np.r_[True, step > 0]]
+            if len(line) < 2:
+                raise ValueError('Road %d has no length' % len(points))
+            points.append(line)
+        self.Points = np.concatenate(points)
+        counts = np.array([len(line) for line in points])
+        self.Edge_PointStart = np.r_[0, np.cumsum(counts)[:-1]]
+        # Distance along the road of every point
+        step = np.linalg.norm(np.diff(self.Points, axis=0), axis=1)
+        dist = np.r_[0, np.cumsum(step)]
+        self.Point_Dist = dist - np.repeat(dist[self.Edge_PointStart], counts)
+        self.Edge_Length = self.Point_Dist[self.Edge_PointStart + counts - 1]
+        self.Edge_SegCount = np.maximum(
+            np.round(self.Edge_Length / SegLength), 1).astype(int)
+        # Same distances growing over all roads (one unit between roads)
+        self.Edge_DistStart = np.r_[0, np.cumsum(self.Edge_Length + 1)[:-1]]
+        self.Point_GDist = self.Point_Dist \
+            + np.repeat(self.Edge_DistStart, counts)
+
+        # Junctions : road ends at the same place
+        ends = np.concatenate((self.Points[self.Edge_PointStart],
+                               self.Points[self.Edge_PointStart
+                                           + counts - 1]))
+        nodes = merge_points(ends, Tolerance)
+        self.NodeCount = int(nodes.max()) + 1
+        self.Edge_From = nodes[:EdgeCount]
+        self.Edge_To = nodes[EdgeCount:]
+
+        # Roads leaving every junction, sorted by junction, with their
+        # cumulated weights (junction + fraction, to choose with one search)
+        order = np.argsort(self.Edge_From, kind='stable')
+        self.Out_Edge = order
+        out_count = np.bincount(self.Edge_From, minlength=self.NodeCount)
+        self.Node_OutCount = out_count
+        if (out_count == 0).any():
+            raise ValueError('Junction %d has no road leaving it'
+                             % np.flatnonzero(out_count == 0)[0])
+        weight = self.Edge_Weight[order]
+        group = self.Edge_From[order]
+        cum = np.cumsum(weight)
+        start = np.r_[0, np.cumsum(out_count)[:-1]]
+        before = np.repeat(np.r_[0, cum][start], out_count)
+        total = np.repeat(np.add.reduceat(weight, start), out_count)
+        self.Out_Key = group + (cum - before) / total
+        self.Out_Key[np.r_[start[1:], len(order)] - 1] = np.arange(
+            1, self.NodeCount + 1)
+
+    # Choose at random the road following roads (at their end junction)
+    # Cars make a U-turn (road back to where they come from) only at
+    # dead ends (or after a few draws of U-turns only)
+    def choose_turns(self, edges, rng):
+        node = self.Edge_To[edges]
+        turns = np.empty(len(edges), dtype=int)
+        todo = np.arange(len(edges))
+        for draw in range(8):
+            pick = self.Out_Edge[np.searchsorted(
+                self.Out_Key, node[todo] + rng.random(len(todo)), 'right')]
+            turns[todo] = pick
+            back = (self.Edge_To[pick] == self.Edge_From[edges[todo]]) \
+                & (self.Node_OutCount[node[todo]] > 1)
+            todo = todo[back]
+        return turns
+
+    # Position and heading (radians, in the xy plane) of segments of roads
+    # A segment is at the middle of its length along the road
+    # return x, y, z, heading (same shape as edge and segment)
+    def positions(self, edge, segment):
+        edge = np.asarray(edge)
+        dist = (segment - 0.5) * (self.Edge_Length[edge]
+                                  / self.Edge_SegCount[edge])
+        start = self.Edge_PointStart[edge]
+        end = np.r_[self.Edge_PointStart[1:], len(self.Points)][edge]
+        # Index of the point before dist, kept inside the road
+        low = np.searchsorted(self.Point_GDist,
+                              self.Edge_DistStart[edge] + dist, 'right') - 1
+        low = np.clip(low, start, end - 2)
+        p0 = self.Points[low]
+        p1 = self.Points[low + 1]
+        span = self.Point_Dist[low + 1] - self.Point_Dist[low]
+        f = ((dist - self.Point_Dist[low]) / span)[..., None]
+        p = p0 + (p1 - p0) * f
+        heading = np.arctan2(p1[..., 1] - p0[..., 1], p1[..., 0] - p0[..., 0])
+        return p[..., 0], p[..., 1], p[..., 2], heading
+
+    # Network written with trajectories (to replay them)
+    def trajectory_info(self):
+        return {'Points': self.Points,
+                'Edge_PointStart': self.Edge_PointStart,
+                'Edge_Priority': self.Edge_Priority,
+                'Edge_Weight': self.Edge_Weight,
+                'SegLength': np.array(self.SegLength)}
+
+
+# Rebuild the network of a trajectory recorded by TrafficNetwork
+def trajectory_network(traj):
+    lines = np.split(traj['Points'], traj['Edge_PointStart'][1:])
+    return RoadNetwork(lines, traj['Edge_Priority'], traj['Edge_Weight'],
+                       float(traj['SegLength']))
+
+
+# Grid of two way streets (Size x Size junctions, BlockSegments segments
+# between two junctions). Streets along x have the priority
+def grid_network(Size=10, BlockSegments=40):
+    block = BlockSegments * SizeCarX
+    lines = []
+    priorities = []
+    for i in range(Size):
+        for j in range(Size - 1):
+            for a, b, priority in ((j, j + 1, 1), (j + 1, j, 1)):
+                lines.append([(a * block, i * block, 0),
+                              (b * block, i * block, 0)])
+                priorities.append(priority)
+            for a, b in ((j, j + 1), (j + 1, j)):
+                lines.append([(i * block, a * block, 0),
+                              (i * block, b * block, 0)])
+                priorities.append(0)
+    return RoadNetwork(lines, priorities)
+
+
+# Cars on a road network, one lane by road
+# Arrays are indexed by car (1 to CarCount), index 0 is unused
+class TrafficNetwork:
+    # Parameters and state for checkpoints (see Traffic_Jam_Sim.resume)
+    Params = ('CarCount', 'SpeedWish', 'EdgeCount')
+    StateNames = ('Car_Edge', 'Car_Seg', 'Car_Speed', 'Car_Frac',
+                  'Car_Turn', 'tick')
+    Fields = NetworkFields
+    TickTime = 1
+
+    def __init__(self, network, CarCount=1000, SpeedWish=50, seed=0):
+        self.network = network
+        self.EdgeCount = network.EdgeCount
+        self.CarCount = CarCount
+        self.SpeedWish = SpeedWish
+        self.rng = np.random.default_rng(seed)
+
+        self.Car_Edge = np.zeros((CarCount + 1), dtype=int)
+        self.Car_Seg = np.zeros((CarCount + 1), dtype=int)  # 1 to SegCount
+        self.Car_Speed = np.zeros((CarCount + 1), dtype=int)  # Km/h
+        self.Car_Frac = np.zeros((CarCount + 1))
+        # Road chosen at the end of the road of the car
+        self.Car_Turn = np.zeros((CarCount + 1), dtype=int)
+
+        # Cars stopped at junctions must speed up again from any speed
+        self.Speed_Table, self.GapMax = \
+            Traffic_Jam_Sim.speed_table(SpeedWish, MinAccel=1)
+        self.tick = 0
+
+    # Cars state for the trajectory fields (views, no copy)
+    def rows(self):
+        return {'edge': self.Car_Edge, 'segment': self.Car_Seg,
+                'speed': self.Car_Speed}
+
+    # Parameters written with trajectories
+    def trajectory_info(self):
+        info = {'CarCount': np.array(self.CarCount),
+                'SpeedWish': np.array(self.SpeedWish),
+                'TickTime': np.array(self.TickTime)}
+        info.update(self.network.trajectory_info())
+        return info
+
+    # Initial State
+    # Cars are placed at same distance on all roads end to end, stopped
+    def initial_state(self):
+        SegCounts = self.network.Edge_SegCount
+        total = int(SegCounts.sum())
+        if self.CarCount * 2 > total:
+            raise ValueError('%d cars on %d segments, 2 segments by car '
+                             'needed' % (self.CarCount, total))
+        place = (np.arange(self.CarCount) * total) // self.CarCount
+        starts = np.r_[0, np.cumsum(SegCounts)[:-1]]
+        edge = np.searchsorted(starts, place, 'right') - 1
+        self.Car_Edge[1:] = edge
+        self.Car_Seg[1:] = place - starts[edge] + 1
+        self.Car_Speed[:] = 0
+        self.Car_Frac[:] = 0
+        self.Car_Turn[1:] = self.network.choose_turns(edge, self.rng)
+        self.tick = 0
+
+    # Give space between every car and the car in front of (segment unit)
+    # The first car of a road see the end of its road, then the last car
+    # of the road it turns to (up to GapMax), or the end of its road when
+    # it has to yield at the junction
+    # return space_IFO and leader (first car of its road), by car - 1
+    def get_all_space_IFO(self):
+        net = self.network
+        edge = self.Car_Edge[1:]
+        segment = self.Car_Seg[1:]
+        SegCount = net.Edge_SegCount[edge]
+
+        # Occupancy index : cars sorted by road then segment
+        order = np.lexsort((segment, edge))
+        sorted_edge = edge[order]
+        sorted_seg = segment[order]
+        space = np.empty(self.CarCount, dtype=int)
+        space[order[:-1]] = sorted_seg[1:] - sorted_seg[:-1]
+        leader = np.zeros(self.CarCount, dtype=bool)
+        leader[order] = np.r_[sorted_edge[1:] != sorted_edge[:-1], True]
+
+        # Last car of every road (lowest segment), SegCount + 1 when empty
+        first = np.r_[True, sorted_edge[1:] != sorted_edge[:-1]]
+        last_seg = net.Edge_SegCount + 1
+        last_seg[sorted_edge[first]] = sorted_seg[first]
+        last_seg = np.minimum(last_seg, self.GapMax)
+
+        # A leader waiting at the end of its road for a road with no room
+        # choose again where it goes, so full roads never lock in a loop
+        turn = self.Car_Turn[1:]
+        remain = SegCount - segment
+        stuck = np.flatnonzero(leader & (remain == 0) & (last_seg[turn] <= 1))
+        if len(stuck) > 0:
+            turn[stuck] = net.choose_turns(edge[stuck], self.rng)
+
+        # Priority : leaders close to their junction claim it, if they
+        # can enter the road they turn to (else nobody would pass)
+        near = leader & (remain < self.GapMax) & (last_seg[turn] > 1)
+        claim = np.full(net.NodeCount, np.iinfo(int).min)
+        np.maximum.at(claim, net.Edge_To[edge[near]],
+                      net.Edge_Priority[edge[near]])
+        yields = claim[net.Edge_To[edge]] > net.Edge_Priority[edge]
+
+        space[leader] = np.where(yields[leader], remain[leader] + 1,
+                                 remain[leader] + last_seg[turn[leader]])
+        return space, leader
+
+    # Move all cars one tick in one set of numpy operations
+    def step(self):
+        self.tick += 1
+        with profiler.timer('simulation'):
+            net = self.network
+            space_IFO, leader = self.get_all_space_IFO()
+            speed = self.Car_Speed[1:]
+            speed[:] = self.Speed_Table[speed,
+                                        np.minimum(space_IFO, self.GapMax)]
+
+            # Segments run (part of segment carried), never reaching the
+            # car in front of
+            distance = self.Car_Frac[1:] + speed * CoefSpeed
+            move = np.minimum(np.floor(distance), space_IFO - 1).astype(int)
+            self.Car_Frac[1:] = np.where(move < np.floor(distance), 0,
+                                         distance - move)
+
+            edge = self.Car_Edge[1:]
+            segment = self.Car_Seg[1:]
+            SegCount = net.Edge_SegCount[edge]
+            cross = np.flatnonzero(segment + move > SegCount)
+            if len(cross) > 0:
+                # One car by road entered : the highest priority, then the
+                # most advanced, the others wait at the end of their road
+                turn = self.Car_Turn[1:][cross]
+                rank = np.lexsort((-(segment[cross] + move[cross]
+                                     - SegCount[cross]),
+                                   -net.Edge_Priority[edge[cross]], turn))
+                passed = np.zeros(len(cross), dtype=bool)
+                passed[rank] = np.r_[True, turn[rank][1:] != turn[rank][:-1]]
+                wait = cross[~passed]
+                move[wait] = SegCount[wait] - segment[wait]
+                speed[wait] = 0
+                self.Car_Frac[1:][wait] = 0
+
+                go = cross[passed]
+                segment[go] += move[go] - SegCount[go]
+                edge[go] = self.Car_Turn[1:][go]
+                self.Car_Turn[1:][go] = net.choose_turns(edge[go], self.rng)
+                move[go] = 0
+                profiler.count('junctions', len(go))
+            segment += move
+        profiler.count('ticks')
+        profiler.count('car_moves', self.CarCount)
+
+
+# Consumer counting the cars that moved (changed of road or of segment)
+# during every Window ticks, to see if the network keeps flowing
+class FlowCheck:
+    def __init__(self, Window=500):
+        self.Window = Window
+        self.ticks = 0
+        self.moved = []
+
+    def consume(self, sim):
+        if self.ticks % self.Window == 0:
+            if self.ticks > 0:
+                self.moved.append(int(np.count_nonzero(
+                    (sim.Car_Edge[1:] != self.edge)
+                    | (sim.Car_Seg[1:] != self.segment))))
+            self.edge = sim.Car_Edge[1:].copy()
+            self.segment = sim.Car_Seg[1:].copy()
+        self.ticks += 1
+
+    def close(self):
+        pass
+
+
+# Run a network TickCount ticks and check it keeps flowing : in every
+# Window ticks, at least MinMoving of the cars move
+# raise RuntimeError when cars lock (deadlock at junctions, gridlock)
+# return the number of cars that moved by window
+def check_flow(sim, TickCount=5000, Window=500, MinMoving=0.9):
+    flow = FlowCheck(Window)
+    Traffic_Jam_Sim.run(sim, [flow], TickCount + 1)
+    for index, moved in enumerate(flow.moved):
+        if moved < MinMoving * sim.CarCount:
+            raise RuntimeError('Only %d cars of %d moved in ticks %d to %d'
+                               % (moved, sim.CarCount, index * Window,
+                                  (index + 1) * Window))
+    return flow.moved
+
+
+# Main
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['check']:
+        for gridSize, blockSegments, carCount, tickCount in (
+                (6, 10, 150, 5000), (30, 40, 20000, 2000)):
+            sim = TrafficNetwork(grid_network(gridSize, blockSegments),
+                                 CarCount=carCount)
+            sim.initial_state()
+            moved = check_flow(sim, tickCount, tickCount // 10)
+            print('grid %d, %d cars, %d ticks : cars moving %s' % (
+                gridSize, carCount, tickCount, moved))
+        sys.exit()
+
+    # Check input parameters
+    if len(sys.argv) > 1:
+        gridSize = int(sys.argv[1])
+    else:
+        gridSize = 30
+    if len(sys.argv) > 2:
+        carCount = int(sys.argv[2])
+    else:
+        carCount = 20000
+    if len(sys.argv) > 3:
+        tickCount = int(sys.argv[3])
+    else:
+        tickCount = 400
+
+    sim = TrafficNetwork(grid_network(gridSize), CarCount=carCount)
+    sim.initial_state()
+    if len(sys.argv) > 4:
+        Traffic_Jam_Sim.save_trajectory(
+            sys.argv[4], Traffic_Jam_Sim.record_trajectory(sim, tickCount))
+    else:
+        start = time.perf_counter()
+        for t in range(tickCount):
+            sim.step()
+        duration = time.perf_counter() - start
+        print('%d ticks/s, mean speed %.1f km/h' % (
+            tickCount / duration, sim.Car_Speed[1:].mean()))
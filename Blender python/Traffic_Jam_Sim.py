@@ -0,0 +1,845 @@
+"""
+Traffic_Jam_Sim
+
+Headless simulation core of the Traffic Jam Simulator (Traffic_Jam.py)
+Runs without Blender (numpy only) and records the trajectory of all cars
+into a compact .npz file, replayed onto the cars by Traffic_Jam.py
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python Traffic_Jam_Sim.py [trajectoryFile] [tickCount] [carCount] [segCount]
+                              [tickTime] [checkpointFile]
+
+    trajectoryFile => .npz file written (lane, segment, laps, speed by tick)
+    tickCount => number of simulation ticks
+    carCount => number of cars
+    segCount => number of segments of the road
+    tickTime => simulated seconds by tick (1 by default)
+    checkpointFile => state saved every 100 ticks, the run continue from
+                      it when it exists (same other parameters)
+
+Profiling :
+    TRAFFIC_JAM_PROFILE=1 print named timers and counters at the end
+    TRAFFIC_JAM_PROFILE=file.json write them into a JSON file
+"""
+
+import sys
+import os
+import time
+import json
+import math
+import zipfile
+import contextlib
+import numpy as np
+
+# The segment represent place to put one car (SizeCarX) or nothing
+SizeCarX = 5  # 5 meters, mean also the size of one segment
+# transform speed in km/h into segment unit in second
+CoefSpeed = 1 / 3600 * 1000 / SizeCarX
+# Longest step (seconds). In 2 seconds a car runs 0.555 m by km/h, about
+# 75 % of its secure distance (0.7425 m by km/h), so it stays behind the
+# car in front. Longer ticks are cut into sub-steps
+MaxStepTime = 2
+# Drivers apply the speed rules once by second (their reaction time),
+# shorter steps only move the cars
+MinRuleTime = 1
+
+
+# Timer adding its duration to one named timer of a profiler
+class ProfileTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        timers = self.profiler.timers
+        seconds, calls = timers.get(self.name, (0.0, 0))
+        timers[self.name] = (seconds + duration, calls + 1)
+
+
+# Named timers and counters, doing nothing while disabled
+# setting : '' disabled, a .json file to write the summary, else print it
+class Profiler:
+    def __init__(self, setting=''):
+        self.setting = setting
+        self.enabled = bool(setting)
+        self.timers = {}
+        self.counters = {}
+
+    # with profiler.timer('name'): time the block
+    def timer(self, name):
+        if not self.enabled:
+            return NoTimer
+        return ProfileTimer(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        return {'timers': {name: {'seconds': round(seconds, 6),
+                                  'calls': calls}
+                           for name, (seconds, calls) in self.timers.items()},
+                'counters': dict(self.counters)}
+
+    # Print or write the summary (nothing while disabled)
+    def report(self):
+        if not self.enabled:
+            return
+        if self.setting.endswith('.json'):
+            with open(self.setting, 'w') as file:
+                json.dump(self.summary(), file, indent=2)
+            return
+        for name, (seconds, calls) in self.timers.items():
+            print('%-12s %10.4f s %8d calls' % (name, seconds, calls))
+        for name, value in self.counters.items():
+            print('%-12s %10d' % (name, value))
+
+
+NoTimer = contextlib.nullcontext()
+profiler = Profiler(os.environ.get('TRAFFIC_JAM_PROFILE', ''))
+
+
+# calculate the new speed from a speed and the space in front of
+# Reference rules, used to fill the speed table
+# dt is the duration of the step (seconds), acceleration is by second
+# MinAccel is the smallest acceleration (km/h) : with 0 (the circle road)
+# cars at 5 km/h or less never speed up again, the network uses 1
+def limit_speed(Speed, space_IFO, SpeedWish, dt=1, MinAccel=0) -> int:
+    # Search the speed limit to preserve speed objective and security distance
+
+    # if speed < wish speed then attempt to accelerate a bit (10 percents)
+    if (Speed < SpeedWish):
+        if Speed == 0:
+            Speed = round((SpeedWish // 10) * dt)
+        else:
+            Speed = Speed + max(round(Speed * 0.10 * dt), MinAccel)
+        if (Speed > SpeedWish):
+            Speed = SpeedWish
+
+    # and now check if the speed choosen is acceptable for security reason
+    # if not, adapt it
+    space_IFO = space_IFO * SizeCarX  # set space_IFO in meters
+    Secure_Dist = (Speed * 0.55) * 1.35
+    quantum = round(Speed * 0.10)
+    while space_IFO < Secure_Dist:
+        # Slow down a bit (10 percents)
+        Speed = Speed - quantum
+        Secure_Dist = (Speed * 0.55) * 1.35
+        # In case of full stop
+        if (Speed < 0):
+            Speed = 0
+            break
+    return Speed  # km/h
+
+
+# Precompute limit_speed for every speed (0 to SpeedWish) and every space
+# Beyond GapMax segments no car need to brake, so space is clamped to it
+# A space of 0 never happens (one car by segment), it is left to full stop
+# return the table and GapMax
+def speed_table(SpeedWish, dt=1, MinAccel=0):
+    GapMax = int((SpeedWish * 0.55) * 1.35 // SizeCarX) + 1
+    table = np.zeros(((SpeedWish + 1), (GapMax + 1)), dtype=int)
+    for Speed in range(0, SpeedWish + 1):
+        for space_IFO in range(1, GapMax + 1):
+            table[Speed, space_IFO] = limit_speed(Speed, space_IFO,
+                                                    SpeedWish, dt, MinAccel)
+    return table, GapMax
+
+
+# Cars state written by tick in trajectories, with their types
+TrajectoryFields = {'lane': np.int16, 'segment': np.int32,
+                    'laps': np.int32, 'speed': np.int16}
+
+
+# One road (circle) with its cars
+# Arrays are indexed by car (1 to CarCount), index 0 is unused
+# One tick last TickTime seconds, computed in SubSteps steps of StepTime
+# seconds when longer than MaxStepTime. Speed rules and lane changes are
+# applied every RuleTime seconds, cars move at every step
+class TrafficSim:
+    # Parameters a checkpoint must share with the simulation resumed,
+    # and the state it holds (by car, never by segment of the road)
+    Params = ('SegCount', 'LaneCount', 'CarCount', 'SpeedWish', 'TickTime')
+    StateNames = ('Car_Pos', 'Car_Rot', 'Car_Speed',
+                  'Car_Frac', 'Car_Next', 'tick', 'steps', 'rule',
+                  'SlowCar', 'SlowStart', 'SlowEnd', 'SlowSpeed')
+    Fields = TrajectoryFields
+
+    def __init__(self, SegCount=500, LaneCount=1, CarCount=32, SpeedWish=130,
+                 Vectorized=True, TickTime=1):
+        self.SegCount = SegCount
+        self.LaneCount = LaneCount
+        self.CarCount = CarCount
+        self.SpeedWish = SpeedWish
+        # Move all cars in one set of numpy operations
+        self.Vectorized = Vectorized
+        self.TickTime = TickTime
+        self.SubSteps = max(1, math.ceil(TickTime / MaxStepTime))
+        self.StepTime = TickTime / self.SubSteps
+        self.RuleTime = max(self.StepTime, MinRuleTime)
+
+        # Slow down one car between SlowStart and SlowEnd (seconds, excluded)
+        self.SlowCar = 10
+        self.SlowStart = 20
+        self.SlowEnd = 40
+        self.SlowSpeed = SpeedWish // 6
+
+        # I know, I can use multidimmensionnal array but I won't
+        # 1 - lane, 2 - segment
+        self.Car_Pos = np.zeros(((CarCount + 1), 3), dtype=int)
+        self.Car_Rot = np.zeros((CarCount + 1), dtype=int)  # laps count
+        self.Car_Speed = np.zeros((CarCount + 1), dtype=int)  # Km/h
+        # Part of segment run and not yet moved (no rounding lost)
+        self.Car_Frac = np.zeros((CarCount + 1))
+        # Occupancy index : the car in front of each car on its lane
+        # Cars never overtake on a lane, so this ring stays true while moving
+        self.Car_Next = np.zeros((CarCount + 1), dtype=int)
+
+        # Speed rules as a lookup table (speed, space in front of)
+        self.Speed_Table, self.GapMax = speed_table(SpeedWish, self.RuleTime)
+        self.tick = 0
+        self.steps = 0
+        self.rule = 0
+
+    # Cars state for the trajectory fields (views, no copy)
+    def rows(self):
+        return {'lane': self.Car_Pos[:, 1], 'segment': self.Car_Pos[:, 2],
+                'laps': self.Car_Rot, 'speed': self.Car_Speed}
+
+    # Parameters written with trajectories
+    def trajectory_info(self):
+        return {'SegCount': np.array(self.SegCount),
+                'LaneCount': np.array(self.LaneCount),
+                'CarCount': np.array(self.CarCount),
+                'SpeedWish': np.array(self.SpeedWish),
+                'TickTime': np.array(self.TickTime)}
+
+    # Initial State
+    # Place cars belong the lanes of the road, all at wish speed
+    def initial_state(self):
+        # Dispatch cars on the road
+        # For sample here we use the dispatch fair
+        # Same amount of car by lane
+        # Place on all lanes end to end, spread exactly (integers) so two
+        # cars never share a place
+        places = self.LaneCount * self.SegCount
+        place = np.arange(self.CarCount) * places // self.CarCount
+        lane = place // self.SegCount + 1
+        segment = place % self.SegCount + 1
+        if len(np.unique(place)) != self.CarCount:
+            raise ValueError('%d cars do not fit on %d lanes of %d segments'
+                             % (self.CarCount, self.LaneCount, self.SegCount))
+        self.Car_Pos[1:, 1] = lane
+        self.Car_Pos[1:, 2] = segment
+        self.Car_Rot[:] = 0
+        self.Car_Speed[1:] = self.SpeedWish
+        self.Car_Frac[:] = 0
+        self.build_car_ring()
+        self.tick = 0
+        self.steps = 0
+        self.rule = 0
+
+    # Car on every segment of every lane (0 for none), built from Car_Pos
+    # when asked (debugging) : the simulation only uses Car_Next
+    # return array (LaneCount + 1, SegCount + 1)
+    def road_segments(self):
+        road = np.zeros(((self.LaneCount + 1), (self.SegCount + 1)),
+                        dtype=int)
+        road[self.Car_Pos[1:, 1], self.Car_Pos[1:, 2]] = \
+            np.arange(1, self.CarCount + 1)
+        return road
+
+    # Sort cars by lane then by segment (occupancy index of all lanes)
+    # return order (car - 1 by rank), sorted lanes and sorted segments
+    def sort_cars(self):
+        lane = self.Car_Pos[1:, 1]
+        segment = self.Car_Pos[1:, 2]
+        order = np.lexsort((segment, lane))
+        return order, lane[order], segment[order]
+
+    # Build the occupancy index of all lanes (ring of successors)
+    # In sorted order, the car in front of a car is the next one
+    # (the road is a circle, the last car of a lane follow the first one)
+    def build_car_ring(self):
+        order, sorted_lane, sorted_seg = self.sort_cars()
+
+        # Index (in sorted order) of the car in front of
+        first = np.flatnonzero(np.r_[True, sorted_lane[1:] != sorted_lane[:-1]])
+        last = np.r_[first[1:], self.CarCount] - 1
+        front = np.arange(1, self.CarCount + 1)
+        front[last] = first
+
+        self.Car_Next[order + 1] = order[front] + 1
+
+    # Find, for cars looking at the same segment on other lanes, the cars
+    # in front of and behind them on these lanes (binary search in the
+    # sorted occupancy index, no road scan)
+    # return free (segment empty), space in front of and space behind
+    # (in segment unit, SegCount on an empty lane) and the car behind
+    def lane_neighbors(self, lanes, segments):
+        order, sorted_lane, sorted_seg = self.sort_cars()
+        key = sorted_lane * (self.SegCount + 1) + sorted_seg
+        start = np.searchsorted(sorted_lane, lanes, 'left')
+        end = np.searchsorted(sorted_lane, lanes, 'right')
+        empty = start == end
+
+        # First car at or after the segment, last car before it
+        pos = np.searchsorted(key, lanes * (self.SegCount + 1) + segments)
+        front = np.where(pos < end, pos, start)
+        back = np.where(pos > start, pos - 1, end - 1)
+        front = np.where(empty, 0, front)
+        back = np.where(empty, 0, back)
+
+        front_space = (sorted_seg[front] - segments) % self.SegCount
+        back_space = (segments - sorted_seg[back]) % self.SegCount
+        free = empty | (front_space != 0)
+        front_space[empty | (front_space == 0)] = self.SegCount
+        back_space[empty | (back_space == 0)] = self.SegCount
+        back_car = np.where(empty, 0, order[back] + 1)
+        return free, front_space, back_space, back_car
+
+    # Change lanes of all cars at once
+    # Odd rules cars overtake (lane + 1) when the car in front slows them
+    # and there is more space on the next lane, even rules they go back
+    # (lane - 1) when the road is free in front of them there.
+    # In both cases the car behind on the new lane must keep its security
+    # distance. Moving in one direction at once, cars never collide.
+    # return the number of cars changing lane
+    def change_lanes(self, rule) -> int:
+        if self.LaneCount < 2:
+            return 0
+        direction = 1 if rule % 2 == 1 else -1
+        lane = self.Car_Pos[1:, 1]
+        segment = self.Car_Pos[1:, 2]
+        target = np.clip(lane + direction, 1, self.LaneCount)
+        space_IFO = self.get_all_space_IFO()[1:]
+
+        free, front_space, back_space, back_car = \
+            self.lane_neighbors(target, segment)
+        back_dist = (self.Car_Speed[back_car] * 0.55) * 1.35
+        safe = free & (back_space * SizeCarX >= back_dist) & (target != lane)
+        if direction > 0:
+            want = (space_IFO < self.GapMax) & (front_space > space_IFO)
+        else:
+            want = front_space >= self.GapMax
+        change = safe & want
+
+        count = int(np.count_nonzero(change))
+        profiler.count('lane_changes', count)
+        if count > 0:
+            lane[change] = target[change]
+            self.build_car_ring()
+        return count
+
+    # Give space between car and car in front of
+    # The car in front is read from the occupancy index (no road scan)
+    # return space_IFO in segment unit
+    def get_space_IFO(self, car) -> int:
+        Car_IFO = self.Car_Next[car]
+        space_IFO = (self.Car_Pos[Car_IFO, 2] - self.Car_Pos[car, 2]) \
+            % self.SegCount
+        # Alone on its lane, a car see the whole road in front of it
+        if space_IFO == 0:
+            space_IFO = self.SegCount
+        return space_IFO
+
+    # Give space between every car and the car in front of, all at once
+    # return space_IFO in segment unit, indexed by car
+    def get_all_space_IFO(self):
+        space_IFO = (self.Car_Pos[self.Car_Next, 2] - self.Car_Pos[:, 2]) \
+            % self.SegCount
+        # Alone on its lane, a car see the whole road in front of it
+        space_IFO[space_IFO == 0] = self.SegCount
+        space_IFO[0] = 0
+        return space_IFO
+
+    # calculate the new speed for a car
+    def new_speed(self, car, space_IFO) -> int:
+        return self.Speed_Table[self.Car_Speed[car],
+                                min(space_IFO, self.GapMax)]  # km/h
+
+    # calculate the new speed for all cars at once
+    # Same rules as new_speed, with arrays indexed by car
+    def new_speeds(self, speeds, space_IFO):
+        return self.Speed_Table[speeds,
+                                np.minimum(space_IFO, self.GapMax)]  # km/h
+
+    # Is the slow down scenario running at time t (SlowCar 0 = never)
+    def slow_down(self, t) -> bool:
+        return (1 <= self.SlowCar <= self.CarCount) and \
+            (t > self.SlowStart and t < self.SlowEnd)
+
+    # Segments run during one step at speed (km/h), for one car or all
+    # The part of segment left is carried to the next step (frac), so slow
+    # cars move too, and a car never reach the car in front of
+    # return segments to move and the new part of segment left
+    def move_segments(self, speed, space_IFO, frac):
+        distance = frac + speed * CoefSpeed * self.StepTime
+        move = np.minimum(np.floor(distance), space_IFO - 1)
+        frac = np.where(move < np.floor(distance), 0, distance - move)
+        return move.astype(int), frac
+
+    # Move all cars one step, one car after the other (same rules as step_all,
+    # slower)
+    # Lane changes are still decided for all cars at once
+    # Without rules, cars keep their speed
+    def step_per_car(self, t, rules=True):
+        if rules:
+            self.change_lanes(self.rule)
+        Car_Pos = self.Car_Pos
+        for car in range(1, self.CarCount + 1):
+            # Each Car try to run at maximum speed (speedwish)
+            # Set the new car segment position
+            space_IFO = self.get_space_IFO(car)
+            speed = self.Car_Speed[car]
+            if rules:
+                speed = self.new_speed(car, space_IFO)
+
+                # Slow down one car
+                if (car == self.SlowCar) and self.slow_down(t):
+                    speed = self.SlowSpeed
+
+            self.Car_Speed[car] = speed
+            move, self.Car_Frac[car] = self.move_segments(
+                speed, space_IFO, self.Car_Frac[car])
+            Car_Pos[car, 2] += move
+
+            # Assume the road is a circle
+            # and count number of pass to Pos 0 for managing angle
+            if Car_Pos[car, 2] > self.SegCount:
+                Car_Pos[car, 2] = Car_Pos[car, 2] - self.SegCount
+                self.Car_Rot[car] += 1
+
+    # Move all cars one step in one set of numpy operations
+    # Every car see the road as it was at the start of the step
+    # (after lane changes). Without rules, cars keep their speed
+    def step_all(self, t, rules=True):
+        if rules:
+            self.change_lanes(self.rule)
+        segment = self.Car_Pos[1:, 2]
+        speed = self.Car_Speed[1:]
+        space_IFO = self.get_all_space_IFO()[1:]
+
+        if rules:
+            speed[:] = self.new_speeds(speed, space_IFO)
+
+            # Slow down one car
+            if self.slow_down(t):
+                self.Car_Speed[self.SlowCar] = self.SlowSpeed
+
+        move, self.Car_Frac[1:] = self.move_segments(speed, space_IFO,
+                                                     self.Car_Frac[1:])
+        segment += move
+
+        # Assume the road is a circle
+        # and count number of pass to Pos 0 for managing angle
+        lap = segment > self.SegCount
+        segment[lap] -= self.SegCount
+        self.Car_Rot[1:][lap] += 1
+
+    # Move all cars one tick (SubSteps steps)
+    # Steps are given the simulated time at their end (seconds) and apply
+    # the rules when a new RuleTime period starts
+    def step(self):
+        self.tick += 1
+        with profiler.timer('simulation'):
+            for sub in range(self.SubSteps):
+                self.steps += 1
+                t = self.steps * self.StepTime
+                rule = int(round(t / self.RuleTime, 6))
+                rules = rule > self.rule
+                self.rule = rule
+                if self.Vectorized:
+                    self.step_all(t, rules)
+                else:
+                    self.step_per_car(t, rules)
+        profiler.count('ticks')
+        profiler.count('car_moves', self.CarCount * self.SubSteps)
+
+
+# Move the cars tick after tick and yield the simulation at every tick
+# The first one is the current state (initial state), then one by tick
+# Arrays are the live state, not copies : read them before the next tick
+# Endless when TickCount is None
+# Start is the number of ticks already yielded (run resumed)
+def ticks(sim, TickCount=None, Start=0):
+    count = Start
+    while TickCount is None or count < TickCount:
+        if count > 0:
+            sim.step()
+        count += 1
+        yield sim
+
+
+# Feed consumers with every tick, until TickCount ticks or stop(sim) true
+# A consumer has consume(sim), called by tick, and close() at the end
+# Start is the number of ticks already consumed (see resume)
+def run(sim, consumers, TickCount=None, stop=None, Start=0):
+    for state in ticks(sim, TickCount, Start):
+        for consumer in consumers:
+            consumer.consume(state)
+        if stop is not None and stop(state):
+            break
+    for consumer in consumers:
+        consumer.close()
+
+
+# Stop condition for run : a jam (car under JamSpeed) came and is gone
+def until_jam_cleared(JamSpeed=30):
+    jam_seen = [False]
+
+    def stop(sim):
+        jam = (sim.Car_Speed[1:] < JamSpeed).any()
+        jam_seen[0] = jam_seen[0] or jam
+        return jam_seen[0] and not jam
+    return stop
+
+
+# Consumer keeping the trajectory in memory, one row by tick
+# Arrays grow when more than TickCount ticks are consumed
+# Fields are the ones of the simulation (sim.Fields, filled by sim.rows)
+class TrajectoryRecorder:
+    def __init__(self, sim, TickCount=400):
+        self.info = sim.trajectory_info()
+        self.arrays = {field: np.zeros((TickCount, (sim.CarCount + 1)),
+                                       dtype=dtype)
+                       for field, dtype in sim.Fields.items()}
+        self.count = 0
+
+    def consume(self, sim):
+        if self.count == len(self.arrays['segment']):
+            for field in self.arrays:
+                self.arrays[field] = np.concatenate(
+                    (self.arrays[field], np.zeros_like(self.arrays[field])))
+        for field, row in sim.rows().items():
+            self.arrays[field][self.count] = row
+        self.count += 1
+
+    def close(self):
+        pass
+
+    # Rows recorded so far, for a checkpoint, and back
+    def checkpoint(self):
+        return self.trajectory()
+
+    def restore(self, state):
+        for field in self.arrays:
+            self.arrays[field] = np.array(state[field])
+        self.count = len(self.arrays['segment'])
+
+    # return the trajectory as a dict of arrays (tick, car)
+    def trajectory(self):
+        traj = {field: array[:self.count]
+                for field, array in self.arrays.items()}
+        traj.update(self.info)
+        return traj
+
+
+# Consumer writing the trajectory into a .npz file by chunks of
+# ChunkTicks ticks, so memory stays the same whatever the run length
+# Chunks are read back as one trajectory by load_trajectory
+# The file is created at the first write (a resumed run keep it)
+# At a checkpoint the file is closed, so it stays readable, and its
+# directory kept : a resumed run put it back over what came after
+class TrajectoryWriter:
+    def __init__(self, file_path, sim, ChunkTicks=1000):
+        self.file_path = file_path
+        self.file = None
+        self.recorder = TrajectoryRecorder(sim, ChunkTicks)
+        self.ChunkTicks = ChunkTicks
+        self.chunk = 0
+
+    def write(self, name, array):
+        if self.file is None:
+            self.file = zipfile.ZipFile(self.file_path, 'w',
+                                        zipfile.ZIP_DEFLATED)
+        with self.file.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asarray(array),
+                                      allow_pickle=False)
+
+    def flush(self):
+        traj = self.recorder.trajectory()
+        for field in self.recorder.arrays:
+            self.write('%s_%06d' % (field, self.chunk), traj[field])
+        self.chunk += 1
+        self.recorder.count = 0
+
+    def consume(self, sim):
+        self.recorder.consume(sim)
+        if self.recorder.count == self.ChunkTicks:
+            self.flush()
+
+    def checkpoint(self):
+        if self.recorder.count > 0:
+            self.flush()
+        self.file.close()
+        with zipfile.ZipFile(self.file_path) as file:
+            start = file.start_dir
+        with open(self.file_path, 'rb') as file:
+            file.seek(start)
+            directory = np.frombuffer(file.read(), dtype=np.uint8)
+        self.file = zipfile.ZipFile(self.file_path, 'a', zipfile.ZIP_DEFLATED)
+        return {'chunk': np.array(self.chunk), 'start': np.array(start),
+                'directory': directory}
+
+    def restore(self, state):
+        if self.file is not None:
+            self.file.close()
+        with open(self.file_path, 'r+b') as file:
+            file.seek(int(state['start']))
+            file.write(state['directory'].tobytes())
+            file.truncate()
+        self.file = zipfile.ZipFile(self.file_path, 'a', zipfile.ZIP_DEFLATED)
+        self.chunk = int(state['chunk'])
+        self.recorder.count = 0
+
+    def close(self):
+        if self.recorder.count > 0:
+            self.flush()
+        for key, value in self.recorder.info.items():
+            self.write(key, value)
+        self.file.close()
+
+
+# Consumer computing statistics of the run (the first tick, the initial
+# state, is only the start point)
+#   mean_speed => mean speed of all cars over the run (km/h)
+#   flow => cars passing a point of the road by hour (all lanes)
+#   jam_duration => seconds with at least one car under JamSpeed
+#   stopped_cars => number of cars fully stopped at least once
+#   max_stopped => maximum number of cars stopped at the same time
+# Durations are in simulated seconds (ticks of TickTime seconds)
+class TrafficStats:
+    def __init__(self, JamSpeed=30):
+        self.JamSpeed = JamSpeed
+        self.ticks = -1
+        self.speed_sum = 0
+        self.jam_duration = 0
+        self.max_stopped = 0
+
+    def distance(self, sim):
+        return sim.Car_Pos[1:, 2] + sim.Car_Rot[1:] * sim.SegCount
+
+    def consume(self, sim):
+        self.ticks += 1
+        if self.ticks == 0:
+            self.SegCount = sim.SegCount
+            self.TickTime = sim.TickTime
+            self.start = self.distance(sim)
+            self.stopped = np.zeros(sim.CarCount, dtype=bool)
+            return
+        speed = sim.Car_Speed[1:]
+        self.speed_sum += int(speed.sum())
+        if (speed < self.JamSpeed).any():
+            self.jam_duration += 1
+        stop = speed == 0
+        self.stopped |= stop
+        self.max_stopped = max(self.max_stopped, int(np.count_nonzero(stop)))
+        self.end = self.distance(sim)
+
+    def close(self):
+        pass
+
+    def checkpoint(self):
+        return get_arrays(self, ('ticks', 'speed_sum', 'jam_duration',
+                                 'max_stopped', 'SegCount', 'TickTime',
+                                 'start', 'stopped', 'end'))
+
+    def restore(self, state):
+        set_arrays(self, state)
+
+    # return the statistics as a dict
+    def result(self):
+        ticks = max(self.ticks, 1)
+        if self.ticks < 1:
+            self.end = self.start
+        # Distance run by all cars, in number of road turns, by hour
+        turns = float((self.end - self.start).sum()) / self.SegCount
+        return {'mean_speed': round(self.speed_sum
+                                    / (ticks * len(self.start)), 2),
+                'flow': round(turns * 3600 / (ticks * self.TickTime), 1),
+                'jam_duration': self.jam_duration * self.TickTime,
+                'stopped_cars': int(np.count_nonzero(self.stopped)),
+                'max_stopped': self.max_stopped}
+
+
+# Named attributes of an object as arrays (missing ones are skipped)
+def get_arrays(obj, names):
+    return {name: np.asarray(getattr(obj, name)) for name in names
+            if hasattr(obj, name)}
+
+
+# Set attributes of an object from arrays (numbers for 0-d arrays)
+def set_arrays(obj, arrays):
+    for name, value in arrays.items():
+        setattr(obj, name, value.item() if value.ndim == 0 else value)
+
+
+# Consumer saving the complete state of the simulation every EveryTicks
+# ticks into file_path, with the random generator of the simulation (if
+# any) and the state of the consumers having checkpoint() and restore()
+# Put it after these consumers in run, so they have seen the tick
+# The file is replaced at once, never left half written
+class Checkpointer:
+    def __init__(self, file_path, consumers=(), EveryTicks=100, Start=0):
+        self.file_path = file_path
+        self.consumers = consumers
+        self.EveryTicks = EveryTicks
+        self.count = Start
+
+    def consume(self, sim):
+        self.count += 1
+        if self.count % self.EveryTicks == 0:
+            save_checkpoint(self.file_path, sim, self.consumers, self.count)
+
+    def close(self):
+        pass
+
+
+# Write the state of the simulation and of its consumers, after count
+# ticks consumed
+def save_checkpoint(file_path, sim, consumers, count):
+    with profiler.timer('checkpoint'):
+        state = get_arrays(sim, sim.Params + sim.StateNames)
+        state['count'] = np.array(count)
+        if hasattr(sim, 'rng'):
+            state['rng'] = np.array(json.dumps(sim.rng.bit_generator.state))
+        for index, consumer in enumerate(consumers):
+            for key, value in consumer.checkpoint().items():
+                state['%d/%s' % (index, key)] = value
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            np.savez(file, **state)
+        os.replace(temp_path, file_path)
+
+
+# Put back the simulation and its consumers (same order as when saved)
+# as they were at the checkpoint
+# return the number of ticks consumed, the Start of run to continue
+def resume(file_path, sim, consumers=()):
+    with np.load(file_path) as data:
+        state = {key: data[key] for key in data.files}
+    for name in sim.Params:
+        if state[name] != getattr(sim, name):
+            raise ValueError('Checkpoint %s has %s = %s, not %s' % (
+                file_path, name, state[name], getattr(sim, name)))
+    set_arrays(sim, {name: state[name] for name in sim.StateNames})
+    if 'rng' in state:
+        sim.rng.bit_generator.state = json.loads(str(state['rng']))
+    for index, consumer in enumerate(consumers):
+        prefix = '%d/' % index
+        consumer.restore({key[len(prefix):]: value
+                          for key, value in state.items()
+                          if key.startswith(prefix)})
+    return int(state['count'])
+
+
+# Run the simulation and record the cars state at every tick
+# Row 0 is the initial state, then one row by tick
+# return the trajectory as a dict of arrays (tick, car)
+def record_trajectory(sim, TickCount):
+    recorder = TrajectoryRecorder(sim, TickCount)
+    run(sim, [recorder], TickCount)
+    return recorder.trajectory()
+
+
+# Write a recorded trajectory into a compressed .npz file
+def save_trajectory(file_path, traj):
+    np.savez_compressed(file_path, **traj)
+
+
+# Read a trajectory file written by save_trajectory or TrajectoryWriter
+# (chunks, named field_000000, are put back together)
+def load_trajectory(file_path):
+    with np.load(file_path) as data:
+        traj = {}
+        chunks = {}
+        for key in sorted(data.files):
+            field, _, number = key.rpartition('_')
+            if len(number) == 6 and number.isdigit():
+                chunks.setdefault(field, []).append(data[key])
+            else:
+                traj[key] = data[key]
+        for field, arrays in chunks.items():
+            traj[field] = np.concatenate(arrays)
+    return traj
+
+
+# Replay of a recorded trajectory as a simulation, to feed consumers (run)
+# Fields are the arrays shaped as 'segment' (tick, car), the others are
+# the trajectory info
+class TrajectoryReplay:
+    def __init__(self, traj):
+        self.traj = traj
+        self.Fields = {field: array.dtype for field, array in traj.items()
+                       if array.shape == traj['segment'].shape}
+        self.CarCount = int(traj['CarCount'])
+        self.TickCount = len(traj['segment'])
+        self.TickTime = float(traj.get('TickTime', 1))
+        self.tick = 0
+
+    # Cars state of the current tick (views, no copy)
+    def rows(self):
+        return {field: self.traj[field][self.tick] for field in self.Fields}
+
+    # Parameters written with the trajectory
+    def trajectory_info(self):
+        return {key: value for key, value in self.traj.items()
+                if key not in self.Fields}
+
+    def step(self):
+        self.tick += 1
+
+
+# Main
+if __name__ == "__main__":
+    # Check input parameters
+    if len(sys.argv) > 1:
+        trajectoryFile = sys.argv[1]
+    else:
+        trajectoryFile = "traffic_jam.npz"
+    if len(sys.argv) > 2:
+        tickCount = int(sys.argv[2])
+    else:
+        tickCount = 400
+    if len(sys.argv) > 3:
+        carCount = int(sys.argv[3])
+    else:
+        carCount = 32
+    if len(sys.argv) > 4:
+        segCount = int(sys.argv[4])
+    else:
+        segCount = 500
+    if len(sys.argv) > 5:
+        tickTime = float(sys.argv[5])
+    else:
+        tickTime = 1
+    if len(sys.argv) > 6:
+        checkpointFile = sys.argv[6]
+    else:
+        checkpointFile = ''
+
+    sim = TrafficSim(SegCount=segCount, CarCount=carCount, TickTime=tickTime)
+    sim.initial_state()
+    writer = TrajectoryWriter(trajectoryFile, sim)
+    consumers = [writer]
+    start = 0
+    if checkpointFile:
+        # Continue from the last checkpoint of a run stopped before its end
+        if os.path.isfile(checkpointFile):
+            start = resume(checkpointFile, sim, [writer])
+        consumers.append(Checkpointer(checkpointFile, [writer], Start=start))
+    with profiler.timer('run'):
+        run(sim, consumers, tickCount, Start=start)
+    profiler.report()
@@ -0,0 +1,121 @@
+"""
+Traffic_Jam_Sweep
+
+Run the Traffic Jam Simulator (Traffic_Jam_Sim.py) over a grid of
+parameters, on all cores, and write one line of statistics by scenario
+into a CSV file (lines are written as soon as scenarios end)
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python Traffic_Jam_Sweep.py [resultsFile] [tickCount] [processCount]
+
+    resultsFile => CSV file written, one line by scenario
+    tickCount => number of simulation ticks (one tick = one second)
+    processCount => number of processes, all cores by default
+
+Statistics by scenario :
+    mean_speed => mean speed of all cars over the run (km/h)
+    flow => cars passing a point of the road by hour (all lanes)
+    jam_duration => seconds with at least one car under JamSpeed
+    stopped_cars => number of cars fully stopped at least once
+    max_stopped => maximum number of cars stopped at the same time
+"""
+
+import sys
+import os
+import csv
+import itertools
+import multiprocessing
+
+import Traffic_Jam_Sim
+
+# Grid of parameters, every combination is a scenario
+CarCounts = [32, 64, 128]
+SpeedWishes = [90, 130]
+SegCounts = [500, 1000]
+LaneCounts = [1]
+# Slow down scenarios : (SlowCar, SlowStart, SlowEnd, SlowSpeed divider)
+# SlowCar 0 mean no slow down
+Slowdowns = [(0, 0, 0, 1), (10, 20, 40, 6), (10, 20, 80, 6)]
+
+# Under this speed (km/h) a car is in a jam
+JamSpeed = 30
+
+Fields = ['CarCount', 'SpeedWish', 'SegCount', 'LaneCount',
+          'SlowCar', 'SlowStart', 'SlowEnd', 'SlowSpeed',
+          'mean_speed', 'flow', 'jam_duration',
+          'stopped_cars', 'max_stopped']
+
+
+# Build all scenarios of the grid
+def scenarios(tickCount):
+    for CarCount, SpeedWish, SegCount, LaneCount, slowdown in \
+            itertools.product(CarCounts, SpeedWishes, SegCounts, LaneCounts,
+                              Slowdowns):
+        SlowCar, SlowStart, SlowEnd, divider = slowdown
+        yield {'CarCount': CarCount, 'SpeedWish': SpeedWish,
+               'SegCount': SegCount, 'LaneCount': LaneCount,
+               'SlowCar': SlowCar, 'SlowStart': SlowStart,
+               'SlowEnd': SlowEnd, 'SlowSpeed': SpeedWish // divider,
+               'tickCount': tickCount}
+
+
+# Run one scenario and compute its statistics
+# return the scenario with its statistics
+def run_scenario(scenario):
+    sim = Traffic_Jam_Sim.TrafficSim(SegCount=scenario['SegCount'],
+                                     LaneCount=scenario['LaneCount'],
+                                     CarCount=scenario['CarCount'],
+                                     SpeedWish=scenario['SpeedWish'])
+    sim.SlowCar = scenario['SlowCar']
+    sim.SlowStart = scenario['SlowStart']
+    sim.SlowEnd = scenario['SlowEnd']
+    sim.SlowSpeed = scenario['SlowSpeed']
+    sim.initial_state()
+
+    stats = Traffic_Jam_Sim.TrafficStats(JamSpeed)
+    # One more tick for the initial state
+    Traffic_Jam_Sim.run(sim, [stats], scenario['tickCount'] + 1)
+
+    result = dict(scenario)
+    del result['tickCount']
+    result.update(stats.result())
+    return result
+
+
+# Run all scenarios on a pool of processes
+# Each result is written into the CSV file as soon as it is known
+def run_sweep(resultsFile, tickCount, processCount):
+    with open(resultsFile, 'w', newline='') as file, \
+            multiprocessing.Pool(processCount) as pool:
+        writer = csv.DictWriter(file, fieldnames=Fields)
+        writer.writeheader()
+        for result in pool.imap_unordered(run_scenario, scenarios(tickCount)):
+            writer.writerow(result)
+            file.flush()
+
+
+# Main
+if __name__ == "__main__":
+    # Check input parameters
+    if len(sys.argv) > 1:
+        resultsFile = sys.argv[1]
+    else:
+        resultsFile = "traffic_jam_sweep.csv"
+    if len(sys.argv) > 2:
+        tickCount = int(sys.argv[2])
+    else:
+        tickCount = 400
+    if len(sys.argv) > 3:
+        processCount = int(sys.argv[3])
+    else:
+        processCount = os.cpu_count()
+
+    # Call main function with parameters
+    run_sweep(resultsFile, tickCount, processCount)
@@ -1,8 +1,7 @@
 import bpy
-import bmesh
-import math
-import time
-import random
+import os
+import sys
+import importlib
 
 # ********************************************************************
 # X_Modulo_2D
@@ -18,35 +17,90 @@ import random
 # Master variables :
 #   Nb_Modulo     Modulo apply to multiplication
 #   TableMulti    Multiplication table
-#   (bpy.context.object.data.bevel_depth) line for choosing your bevel
+#   TubeRadius    Radius of the tubes around the lines
+#   TubeSegments  Number of faces around the tubes
+#   CacheDir      Folder of the meshes already made, with the same master
+#                 variables they are read back. '' for no cache (default),
+#                 '~/.cache/x_modulo' for instance to use it
+#   CacheSizeMax  Size of the cache (bytes), least used meshes removed
+#   Orbits        True to label every tube with the orbit of its first
+#                 vertex, as face attributes for shading (Attribute node) :
+#                 cycle_id (cycle reached), tail_depth (steps before the
+#                 cycle), orbit_size (vertices visited). Not when Animate
+#   Animate       True to sweep the multiplier from TableMulti (frame
+#                 FrameStart) to MultiEnd (frame FrameEnd), real values
+#                 between. One mesh, only its vertices move
+#   MultiEnd      Multiplier at the last frame (Animate)
+#   FrameStart    First frame of the sweep (Animate)
+#   FrameEnd      Last frame of the sweep (Animate)
+#   SweepFile     .pc2 file where all frames are baked, played by a Mesh
+#                 Cache modifier saved with the .blend (reopening, render
+#                 farms), relative to the .blend with '//' (save it
+#                 first). '' to move the vertices at every frame change
+#                 instead, for this session only (handlers are not saved
+#                 with the .blend)
+#                 The file holds every vertex at every frame :
+#                 (FrameEnd - FrameStart + 1) * (Nb_Modulo - 1)
+#                 * 2 * TubeSegments * 12 bytes, 57 MB with the defaults
+#   Raster        True to draw the chords into a density image shown on a
+#                 plane, instead of tubes (huge Nb_Modulo, up to 10^8)
+#   RasterSize    Width and height of the density image (pixels)
+#   RasterFile    '' to pack the image into the .blend, or a .exr or .png
+#                 file where it is saved
+#
+# The geometry is computed by X_Modulo_Geometry.py (no bpy) and put in
+# Blender by X_Modulo_Blender.py (point cache of the sweep written by
+# Point_Cache.py), keep them next to this script. No operator is used,
+# it runs in background too.
 # ********************************************************************
 
 Nb_Modulo = 200
 TableMulti = 2
+TubeRadius = 0.005
+TubeSegments = 6
+CacheDir = ''
+CacheSizeMax = 2 * 1024**3
+Orbits = True
+Animate = False
+MultiEnd = 100.0
+FrameStart = 1
+FrameEnd = 2000
+SweepFile = '//X_Modulo_2D_Sweep.pc2'
+Raster = False
+RasterSize = 4096
+RasterFile = ''
+
+# Find X_Modulo_Geometry.py next to this script (or next to the .blend file)
+for script_dir in (os.path.dirname(os.path.abspath(__file__)),
+                   os.path.dirname(bpy.data.filepath)):
+    if os.path.isfile(os.path.join(script_dir, 'X_Modulo_Geometry.py')):
+        if script_dir not in sys.path:
+            sys.path.append(script_dir)
+        break
+import Point_Cache
+import X_Modulo_Geometry
+import X_Modulo_Blender
+importlib.reload(Point_Cache)  # take edits into account between runs
+importlib.reload(X_Modulo_Geometry)
+importlib.reload(X_Modulo_Blender)
+from X_Modulo_Geometry import circle, circle_points, modulo_edges, \
+    tube_mesh, tube_faces, cached_mesh
+from X_Modulo_Blender import create_collection, fill_mesh, \
+    add_orbit_attributes, build_raster, image_plane, Sweep, animate_sweep
+
+
+# Vertices arround the circle, edges with multiplication table
+# and tubes around the lines
+def build_tubes():
+    verts = circle(size=2, samples=Nb_Modulo)
+    tbedges = modulo_edges(Nb_Modulo, TableMulti)
+    return tube_mesh(verts, tbedges, TubeRadius, TubeSegments)
 
-# Create collection
-def create_collection(collection_name, parent_collection):
-    if collection_name in bpy.data.collections:
-        return bpy.data.collections[collection_name]
-    else:
-        new_collection = bpy.data.collections.new(collection_name)
-        parent_collection.children.link(new_collection)
-        return new_collection
 
+# Points of the circle at any real index (chord ends)
+def points_at(index):
+    return circle_points(2, Nb_Modulo, index)
 
-# Create circle of points (vertices)
-def circle(size, samples):
-    points = []
-    z = 0
-    theta = math.radians(360)  # 2Pi
-    alpha = theta / samples
-    for a in range(0, samples, 1):
-        angle = a * alpha
-        x = size * math.cos(angle)
-        y = size * math.sin(angle)
-        points.append([x, y, z])
-        rot = math.radians(270 + (a*(360/samples)))
-    return points
 
 # ------------------
 # MAIN
@@ -55,41 +109,38 @@ def circle(size, samples):
 # Create a new collection
 newCol = create_collection("XModulo2D", bpy.context.scene.collection)
 
-# Create vertices arround the circle
-verts = circle(size=2, samples=Nb_Modulo)
-
-tbedges = []
-tbfaces = []
-
-# Link vertices to create edges with multiplication table
-for i in range(1, Nb_Modulo, 1):
-    newedge = (i, (i*TableMulti) % Nb_Modulo)
-    tbedges.append(newedge)
-
-mesh = bpy.data.meshes.new("mesh_temp")
-mesh.from_pydata(vertices=verts, edges=tbedges, faces=tbfaces)
-mesh.update()
-
-# create object from mesh
-obj = bpy.data.objects.new("Multi_Modulo_2D", mesh)
-scene = bpy.context.scene
-newCol.objects.link(obj)
+if Raster:
+    # Density image of the chords on a plane, no tubes
+    image = build_raster("XModulo2D_Density", Nb_Modulo, TableMulti,
+                         points_at, 2.04, RasterSize, RasterFile)
+    obj = image_plane("Multi_Modulo_2D", image, 2.04)
+    newCol.objects.link(obj)
+else:
+    if Animate:
+        # One tube by chord (none removed) with the same faces at every frame
+        sweep = Sweep(circle(size=2, samples=Nb_Modulo), points_at,
+                      TableMulti, MultiEnd, FrameStart, FrameEnd, TubeRadius,
+                      TubeSegments)
+        mesh_verts = sweep.frame(FrameStart)
+        mesh_faces = tube_faces(Nb_Modulo - 1, TubeSegments)
+    else:
+        # Tubes around the lines (from the cache when already made)
+        params = {'shape': 'circle', 'size': 2, 'Nb_Modulo': Nb_Modulo,
+                  'TableMulti': TableMulti, 'TubeRadius': TubeRadius,
+                  'TubeSegments': TubeSegments}
+        mesh_verts, mesh_faces = cached_mesh(CacheDir, params, build_tubes,
+                                             CacheSizeMax)
+    # Filled in bulk
+    mesh = bpy.data.meshes.new("mesh_temp")
+    fill_mesh(mesh, mesh_verts, mesh_faces)
+    if Orbits and not Animate:
+        add_orbit_attributes(mesh, Nb_Modulo, TableMulti, TubeSegments)
 
+    # create object from mesh
+    obj = bpy.data.objects.new("Multi_Modulo_2D", mesh)
+    newCol.objects.link(obj)
 
-# convert to curve
-# bevel
-# convert back to mesh
-bpy.ops.object.select_all(action='DESELECT')
-view_layer = bpy.context.view_layer
-obj.select_set(True)
-view_layer.objects.active = obj
-bpy.ops.object.convert(target='CURVE', keep_original=False)
-bpy.context.object.data.dimensions = '3D'
-bpy.context.object.data.bevel_depth = 0.005
-bpy.context.object.data.bevel_resolution = 1  # 6 faces by segments
-bpy.context.object.data.use_radius = False
-bpy.context.object.data.twist_mode = 'Z_UP'
-bpy.context.object.data.fill_mode = 'FULL'
-bpy.ops.object.convert(target='MESH')
+    if Animate:
+        animate_sweep(obj, sweep, SweepFile)
 
 # End of script - Enjoy
@@ -0,0 +1,187 @@
+"""
+X_Modulo_Blender
+
+Blender side of the multiplication by modulo graphs, shared by
+X_Modulo_2D.py and X_Modulo_3D.py : meshes filled in bulk, orbit
+attributes, density image on a plane and the animated multiplier sweep.
+The scripts only give their points (points_at) and master variables, the
+geometry itself is computed by X_Modulo_Geometry.py (no bpy), the sweep
+is baked by Point_Cache.py.
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+"""
+
+import bpy
+import numpy as np
+
+from X_Modulo_Geometry import modulo_edges, sweep_rings, modulo_map, \
+    orbits, density_image, tone_map
+from Point_Cache import write_pc2
+
+
+# Create collection
+def create_collection(collection_name, parent_collection):
+    if collection_name in bpy.data.collections:
+        return bpy.data.collections[collection_name]
+    else:
+        new_collection = bpy.data.collections.new(collection_name)
+        parent_collection.children.link(new_collection)
+        return new_collection
+
+
+# Fill a mesh with vertices and quad faces in bulk (foreach_set)
+def fill_mesh(mesh, verts, faces):
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', verts.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set('vertex_index', faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set('loop_start',
+                              np.arange(0, faces.size, 4, dtype=np.int32))
+    # Face sizes come from loop_start since Blender 4.0
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set('loop_total',
+                                  np.full(len(faces), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+
+# Orbit of the first vertex of every tube (tube_mesh has no tube for a
+# vertex linked to itself) as integer attributes of the tube faces
+def add_orbit_attributes(mesh, Nb_Modulo, TableMulti, TubeSegments):
+    labels = orbits(modulo_map(Nb_Modulo, TableMulti))
+    edges = modulo_edges(Nb_Modulo, TableMulti)
+    first = edges[edges[:, 0] != edges[:, 1], 0]
+    for name, values in labels.items():
+        attribute = mesh.attributes.new(name, 'INT', 'FACE')
+        attribute.data.foreach_set('value',
+                                   np.repeat(values[first], TubeSegments))
+
+
+# Density image of all chords (Raster), log scale, as a float image saved
+# into RasterFile or packed into the .blend ('')
+# points_at(index) : points of the graph (circle_points, sphere_points)
+def build_raster(name, Nb_Modulo, TableMulti, points_at, Extent, RasterSize,
+                 RasterFile=''):
+    density = density_image(Nb_Modulo, TableMulti, points_at, Extent,
+                            RasterSize)
+    pixels = np.ones((RasterSize, RasterSize, 4), dtype=np.float32)
+    pixels[:, :, :3] = tone_map(density)[:, :, None]
+    image = bpy.data.images.new(name, RasterSize, RasterSize,
+                                float_buffer=True)
+    image.pixels.foreach_set(pixels.ravel())
+    if RasterFile:
+        image.filepath_raw = bpy.path.abspath(RasterFile)
+        if RasterFile.lower().endswith('.exr'):
+            image.file_format = 'OPEN_EXR'
+        else:
+            image.file_format = 'PNG'
+        image.save()
+    else:
+        image.pack()
+    return image
+
+
+# Square plane (2 * Extent) showing the image with an emission shader
+def image_plane(name, image, Extent):
+    mesh = bpy.data.meshes.new(name)
+    verts = np.array([(-Extent, -Extent, 0), (Extent, -Extent, 0),
+                      (Extent, Extent, 0), (-Extent, Extent, 0)],
+                     dtype=np.float32)
+    fill_mesh(mesh, verts, np.array([(0, 1, 2, 3)], dtype=np.int32))
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set('uv', np.array([0, 0, 1, 0, 1, 1, 0, 1],
+                                             dtype=np.float32))
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    nodes.clear()
+    texture = nodes.new('ShaderNodeTexImage')
+    texture.image = image
+    emission = nodes.new('ShaderNodeEmission')
+    output = nodes.new('ShaderNodeOutputMaterial')
+    links = material.node_tree.links
+    links.new(texture.outputs['Color'], emission.inputs['Color'])
+    links.new(emission.outputs['Emission'], output.inputs['Surface'])
+    mesh.materials.append(material)
+    return bpy.data.objects.new(name, mesh)
+
+
+# Sweep of the multiplier (Animate), going from TableMulti to MultiEnd
+# between FrameStart and FrameEnd, on the tubes of the chords between
+# points. points_at(index) gives points at real indexes : chord ends
+# slide between the points (circle_points, sphere_points)
+class Sweep:
+    def __init__(self, points, points_at, TableMulti, MultiEnd, FrameStart,
+                 FrameEnd, TubeRadius, TubeSegments):
+        self.points = points
+        self.points_at = points_at
+        self.TableMulti = TableMulti
+        self.MultiEnd = MultiEnd
+        self.FrameStart = FrameStart
+        self.FrameEnd = FrameEnd
+        self.TubeRadius = TubeRadius
+        self.TubeSegments = TubeSegments
+
+    # Vertices of the tubes at a frame of the sweep
+    def frame(self, frame):
+        ratio = (frame - self.FrameStart) \
+            / max(self.FrameEnd - self.FrameStart, 1)
+        ratio = min(max(ratio, 0.0), 1.0)
+        multiplier = self.TableMulti \
+            + (self.MultiEnd - self.TableMulti) * ratio
+        return sweep_rings(self.points, self.points_at, multiplier,
+                           self.TubeRadius, self.TubeSegments)
+
+
+# Object and sweep moved by update_sweep
+Sweep_Object = None
+Sweep_Current = None
+
+
+# Handler called at each frame change (animate without SweepFile), until
+# Blender is closed
+# Move the vertices of the tubes, faces stay the same
+def update_sweep(scn, depsgraph=None):
+    mesh = Sweep_Object.data
+    frame = scn.frame_current + scn.frame_subframe
+    mesh.vertices.foreach_set('co', Sweep_Current.frame(frame).ravel())
+    mesh.update()
+
+
+# Animate the vertices of obj (made from sweep.frame(FrameStart)) over the
+# frames of the sweep : baked into SweepFile, a .pc2 point cache played by
+# a Mesh Cache modifier, or moved by update_sweep when SweepFile is ''
+def animate_sweep(obj, sweep, SweepFile):
+    global Sweep_Object, Sweep_Current
+    scene = bpy.context.scene
+    scene.frame_start = sweep.FrameStart
+    scene.frame_end = sweep.FrameEnd
+    # Remove the handler of a previous run
+    handlers = bpy.app.handlers.frame_change_post
+    for handler in [h for h in handlers if h.__name__ == 'update_sweep']:
+        handlers.remove(handler)
+    if SweepFile:
+        # Bake all frames (one in memory at a time) into a point cache
+        # The modifier keeps SweepFile as given : '//' stays relative
+        # to the .blend, which must be saved to know where it is
+        if SweepFile.startswith('//') and not bpy.data.filepath:
+            raise ValueError("Save the .blend first, SweepFile %s is"
+                             " relative to it" % SweepFile)
+        sweep_path = bpy.path.abspath(SweepFile)
+        frames = range(sweep.FrameStart, sweep.FrameEnd + 1)
+        write_pc2(sweep_path, (sweep.frame(f) for f in frames),
+                  len(frames), len(obj.data.vertices), sweep.FrameStart)
+        modifier = obj.modifiers.new("Sweep", 'MESH_CACHE')
+        modifier.cache_format = 'PC2'
+        modifier.filepath = SweepFile
+        modifier.frame_start = sweep.FrameStart
+    else:
+        Sweep_Object = obj
+        Sweep_Current = sweep
+        handlers.append(update_sweep)
+    scene.frame_set(sweep.FrameStart)
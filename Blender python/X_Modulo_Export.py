@@ -0,0 +1,214 @@
+"""
+X_Modulo_Export
+
+Export the multiplication by modulo graphs (X_Modulo_Geometry.py) without
+Blender : vertices on a circle or a sphere and edges i => i * TableMulti
+(modulo), written into a PLY (binary), OBJ or SVG file, or drawn into a
+density image (PNG or NPY)
+
+Vertices and edges are made and written by chunks of chunkSize, memory
+stays the same whatever Nb_Modulo (up to 10^8 and more)
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+
+Usage :
+    python X_Modulo_Export.py [outFile] [Nb_Modulo] [TableMulti] [shape]
+                              [randomizer] [chunkSize]
+
+    outFile => file written, format from its extension (.ply, .obj, .svg,
+               .png, .npy)
+    Nb_Modulo => modulo apply to multiplication (number of vertices)
+    TableMulti => multiplication table
+    shape => circle (size 2, as X_Modulo_2D.py) or sphere (X_Modulo_3D.py)
+    randomizer => seed of the sphere
+    chunkSize => number of vertices (or edges) made at a time
+
+Formats :
+    ply => binary little endian, elements vertex (x, y, z) and edge
+           (vertex1, vertex2), read by Blender and most 3D tools
+    obj => text, v and l lines
+    svg => chords as paths, seen from above (z axis) for the sphere.
+           Chords of a vertex to itself are left out
+    png => density of the chords seen from above, RasterSize pixels wide,
+           16 bits grayscale (log scale)
+    npy => same density as float32 array (length of chords by pixel,
+           bottom row first), for other tools
+"""
+
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from X_Modulo_Geometry import circle_points, sphere_points, modulo_edges, \
+    density_image, tone_map, png_image
+
+CircleSize = 2
+# Size of the SVG image (pixels) and width of its lines (graph units)
+SvgSize = 2000
+SvgStroke = 0.001
+# Size of the density images (pixels)
+RasterSize = 4096
+Shapes = ('circle', 'sphere')
+
+
+# Coordinates of the vertices of indexes index (float32 (n, 3))
+def shape_points(shape, Nb_Modulo, randomizer, index):
+    if shape == 'circle':
+        return circle_points(CircleSize, Nb_Modulo, index)
+    if shape == 'sphere':
+        return sphere_points(Nb_Modulo, randomizer, index)
+    raise ValueError("Unknown shape %r (%s)" % (shape, ', '.join(Shapes)))
+
+
+# Ranges start to stop cut into chunks of at most chunkSize
+def chunks(start, stop, chunkSize):
+    for first in range(start, stop, chunkSize):
+        yield first, min(first + chunkSize, stop)
+
+
+# Text of rows of values, one line by row with the format line
+# (one % formatting for the whole chunk, much faster than by row)
+def format_rows(line, values):
+    return (line * len(values)) % tuple(values.ravel().tolist())
+
+
+# Binary PLY, vertices then edges
+def write_ply(file, shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    header = ['ply',
+              'format binary_little_endian 1.0',
+              'comment X_Modulo %s Nb_Modulo %d TableMulti %d' %
+              (shape, Nb_Modulo, TableMulti),
+              'element vertex %d' % Nb_Modulo,
+              'property float x',
+              'property float y',
+              'property float z',
+              'element edge %d' % (Nb_Modulo - 1),
+              'property int vertex1',
+              'property int vertex2',
+              'end_header']
+    file.write(('\n'.join(header) + '\n').encode('ascii'))
+    for start, stop in chunks(0, Nb_Modulo, chunkSize):
+        points = shape_points(shape, Nb_Modulo, randomizer,
+                              np.arange(start, stop))
+        file.write(points.astype('<f4').tobytes())
+    for start, stop in chunks(1, Nb_Modulo, chunkSize):
+        edges = modulo_edges(Nb_Modulo, TableMulti, start, stop)
+        file.write(edges.astype('<i4').tobytes())
+
+
+# Text OBJ, vertices then lines (indexes from 1)
+def write_obj(file, shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    file.write(('# X_Modulo %s Nb_Modulo %d TableMulti %d\n'
+                'o X_Modulo\n' % (shape, Nb_Modulo, TableMulti)).encode())
+    for start, stop in chunks(0, Nb_Modulo, chunkSize):
+        points = shape_points(shape, Nb_Modulo, randomizer,
+                              np.arange(start, stop))
+        file.write(format_rows('v %.6f %.6f %.6f\n', points).encode())
+    for start, stop in chunks(1, Nb_Modulo, chunkSize):
+        edges = modulo_edges(Nb_Modulo, TableMulti, start, stop) + 1
+        file.write(format_rows('l %d %d\n', edges).encode())
+
+
+# SVG of the chords seen from above, one path by chunk
+def write_svg(file, shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    size = CircleSize if shape == 'circle' else 1
+    margin = size * 1.02
+    file.write(('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" width="%d" '
+                'height="%d" viewBox="%g %g %g %g">\n'
+                '<g fill="none" stroke="black" stroke-width="%g" '
+                'stroke-linecap="round">\n' %
+                (SvgSize, SvgSize, -margin, -margin, 2 * margin, 2 * margin,
+                 SvgStroke * size)).encode())
+    for start, stop in chunks(1, Nb_Modulo, chunkSize):
+        edges = modulo_edges(Nb_Modulo, TableMulti, start, stop)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        if len(edges) == 0:
+            continue
+        p0 = shape_points(shape, Nb_Modulo, randomizer, edges[:, 0])
+        p1 = shape_points(shape, Nb_Modulo, randomizer, edges[:, 1])
+        # SVG y axis goes down
+        segments = np.stack((p0[:, 0], -p0[:, 1], p1[:, 0], -p1[:, 1]), 1)
+        path = format_rows('M%.5f %.5fL%.5f %.5f', segments)
+        file.write(('<path d="%s"/>\n' % path).encode())
+    file.write(b'</g>\n</svg>\n')
+
+
+# Density of the chords seen from above (z axis)
+def shape_density(shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    size = CircleSize if shape == 'circle' else 1
+    return density_image(
+        Nb_Modulo, TableMulti,
+        lambda index: shape_points(shape, Nb_Modulo, randomizer, index),
+        size * 1.02, RasterSize, ChunkSize=chunkSize)
+
+
+# Density image as 16 bits PNG
+def write_png(file, shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    image = shape_density(shape, Nb_Modulo, TableMulti, randomizer,
+                          chunkSize)
+    file.write(png_image(tone_map(image)))
+
+
+# Density image as float32 numpy array
+def write_npy(file, shape, Nb_Modulo, TableMulti, randomizer, chunkSize):
+    np.save(file, shape_density(shape, Nb_Modulo, TableMulti, randomizer,
+                                chunkSize))
+
+
+Writers = {'.ply': write_ply, '.obj': write_obj, '.svg': write_svg,
+           '.png': write_png, '.npy': write_npy}
+
+
+# Write the graph into outFile, format from its extension
+# Format and shape are checked before the file is opened, so a mistake
+# never leaves a truncated file
+def export(outFile, Nb_Modulo=1000, TableMulti=2, shape='sphere',
+           randomizer=20, chunkSize=1 << 20):
+    extension = os.path.splitext(outFile)[1].lower()
+    if extension not in Writers:
+        raise ValueError("Unknown format %r (%s)" %
+                         (extension, ', '.join(Writers)))
+    if shape not in Shapes:
+        raise ValueError("Unknown shape %r (%s)" % (shape, ', '.join(Shapes)))
+    with open(outFile, 'wb') as file:
+        Writers[extension](file, shape, Nb_Modulo, TableMulti, randomizer,
+                           chunkSize)
+
+
+# Main
+if __name__ == "__main__":
+    # Check input parameters
+    if len(sys.argv) > 1:
+        outFile = sys.argv[1]
+    else:
+        outFile = "x_modulo.ply"
+    if len(sys.argv) > 2:
+        Nb_Modulo = int(float(sys.argv[2]))
+    else:
+        Nb_Modulo = 1000
+    if len(sys.argv) > 3:
+        TableMulti = int(sys.argv[3])
+    else:
+        TableMulti = 2
+    if len(sys.argv) > 4:
+        shape = sys.argv[4]
+    else:
+        shape = 'sphere'
+    if len(sys.argv) > 5:
+        randomizer = int(sys.argv[5])
+    else:
+        randomizer = 20
+    if len(sys.argv) > 6:
+        chunkSize = int(float(sys.argv[6]))
+    else:
+        chunkSize = 1 << 20
+
+    # Call main function with parameters
+    export(outFile, Nb_Modulo, TableMulti, shape, randomizer, chunkSize)
@@ -0,0 +1,483 @@
+"""
+X_Modulo_Geometry
+
+Headless geometry of the multiplication by modulo graphs (X_Modulo_2D.py
+and X_Modulo_3D.py). Runs without Blender (numpy only) : points on a
+circle or a sphere, chords of the multiplication table and tubes around
+the chords, all as numpy arrays ready for foreach_set. The orbits of the
+vertices (cycle reached, steps before it) label the chords for shading.
+
+For animations the multiplier can be any real number : the vertices stay
+in place and the chords end between them (sweep_rings), the tubes keeping
+the same faces at every frame. Frames can be baked into a .pc2 point
+cache (Point_Cache.py) played by a Mesh Cache modifier.
+
+For huge graphs the chords can be drawn into a density image instead
+(density_image) : length of chords by pixel, made by chunks of chords
+and tiles of pixels, saved as a 16 bits PNG (png_image) or kept as float.
+
+Generated meshes can be kept in a disk cache, keyed by their parameters
+(one .npy file by array, loaded memory-mapped), the least recently used
+ones removed beyond a total size.
+
+Author   : Patochun (Patrick M)
+Mail     : ptkmgr@gmail.com
+YT : https://www.youtube.com/channel/UCCNXecgdUbUChEyvW3gFWvw
+
+Licence used : Creative Commons CC BY
+Check licence here : https://creativecommons.org
+"""
+
+import os
+import json
+import zlib
+import struct
+import math
+import random
+import hashlib
+import numpy as np
+
+# Version of the geometry, part of the cache keys. Change it when the
+# geometry functions change, so older cached meshes are not used
+GeometryVersion = 2
+
+
+# Create circle of points (vertices)
+# return coordinates as a float32 array (samples, 3)
+def circle(size, samples):
+    return circle_points(size, samples, np.arange(samples))
+
+
+# Points of the circle at any (real) indexes, between the vertices
+# return coordinates as a float32 array (len(index), 3)
+def circle_points(size, samples, index):
+    theta = math.radians(360)  # 2Pi
+    alpha = theta / samples
+    angle = index * alpha
+    points = np.zeros((len(index), 3), dtype=np.float32)
+    points[:, 0] = size * np.cos(angle)
+    points[:, 1] = size * np.sin(angle)
+    return points
+
+
+# Create vertices on sphere surface
+# return coordinates as a float32 array (samples, 3)
+def Points_Sphere(samples, randomizer):
+    return sphere_points(samples, randomizer, np.arange(samples))
+
+
+# Points of the sphere at any (real) indexes. Between two vertices the
+# point runs along the Fibonacci spiral (next vertex about 137.5 degrees
+# further around the y axis), from the last vertex back to the first one
+# return coordinates as a float32 array (len(index), 3)
+def sphere_points(samples, randomizer, index):
+    rnd = 1.0
+    random.seed(randomizer)
+    rnd = random.random() * samples
+    offset = 2.0 / samples
+    inc = math.pi * (3. - math.sqrt(5.))
+
+    def spiral(i):
+        y = ((i * offset) - 1) + (offset / 2)
+        phi = ((i + rnd) % samples) * inc
+        return y, phi
+
+    index = np.asarray(index)
+    if np.issubdtype(index.dtype, np.integer):
+        y, phi = spiral(index)
+    else:
+        # Vertices on both sides (modulo on whole indexes only)
+        whole = np.floor(index)
+        part = index - whole
+        i = whole.astype(np.int64) % samples
+        y, phi = spiral(i)
+        y_next, phi_next = spiral((i + 1) % samples)
+        turn = (phi_next - phi + math.pi) % (2 * math.pi) - math.pi
+        y = y + part * (y_next - y)
+        phi = phi + part * turn
+    r = np.sqrt(1 - y ** 2)
+    points = np.empty((len(index), 3), dtype=np.float32)
+    points[:, 0] = np.cos(phi) * r
+    points[:, 1] = y
+    points[:, 2] = np.sin(phi) * r
+    return points
+
+
+# Link vertices to create edges with multiplication table
+# Edge i link vertex i to vertex i * TableMulti (modulo), i from 1
+# Only edges start to stop - 1 when given (huge graphs made by parts)
+# return vertex indexes as an int32 array (Nb_Modulo - 1, 2)
+def modulo_edges(Nb_Modulo, TableMulti, start=1, stop=None):
+    if stop is None:
+        stop = Nb_Modulo
+    i = np.arange(start, stop, dtype=np.int64)
+    edges = np.empty((len(i), 2), dtype=np.int32)
+    edges[:, 0] = i
+    edges[:, 1] = (i * TableMulti) % Nb_Modulo
+    return edges
+
+
+# Map of the multiplication : vertex x goes to x * TableMulti (modulo)
+# return the next vertex of every vertex as an int32 array (Nb_Modulo)
+def modulo_map(Nb_Modulo, TableMulti):
+    x = np.arange(Nb_Modulo, dtype=np.int64)
+    return ((x * TableMulti) % Nb_Modulo).astype(np.int32)
+
+
+# Orbits of a map (next vertex of every vertex, as modulo_map) : going
+# from vertex to next vertex, every vertex ends into a cycle
+# Vectorized : pointer jumping (next of next...) and parallel walks
+# return int32 arrays (one value by vertex) :
+#   cycle_id => number of the cycle reached (0 for the cycle of the
+#               smallest vertex, then by their smallest vertex)
+#   tail_depth => steps before reaching the cycle (0 on the cycle)
+#   orbit_size => vertices visited from the vertex (tail and cycle)
+def orbits(next_vertex):
+    count = len(next_vertex)
+    rounds = max(int(count).bit_length(), 1)
+
+    # Vertices reached after 1, 2, 4... steps, until the same vertices
+    # are reached twice in a row : these are the cycles
+    jump = next_vertex
+    on_cycle = np.zeros(count, dtype=bool)
+    on_cycle[jump] = True
+    reached = np.count_nonzero(on_cycle)
+    for _ in range(rounds):
+        jump = jump[jump]
+        on_cycle[:] = False
+        on_cycle[jump] = True
+        if np.count_nonzero(on_cycle) == reached:
+            break
+        reached = np.count_nonzero(on_cycle)
+
+    # Cycles numbered by their smallest vertex, on cycle vertices only
+    cycle_vertex = np.flatnonzero(on_cycle).astype(np.int32)
+    position = np.full(count, -1, dtype=np.int32)
+    position[cycle_vertex] = np.arange(len(cycle_vertex), dtype=np.int32)
+    smallest = cycle_smallest(position[next_vertex[cycle_vertex]])
+    first = np.zeros(len(cycle_vertex), dtype=bool)
+    first[smallest] = True
+    cycle_of = (np.cumsum(first, dtype=np.int32) - 1)[smallest]
+    cycle_length = np.bincount(cycle_of).astype(np.int32)
+    cycle_id = cycle_of[position[jump]]
+
+    # Steps to the cycle : list ranking, cycle vertices are the roots
+    tail_depth = (~on_cycle).astype(np.int32)
+    root = np.where(on_cycle, np.arange(count, dtype=np.int32), next_vertex)
+    for _ in range(rounds):
+        if on_cycle[root].all():
+            break
+        tail_depth += tail_depth[root]
+        root = root[root]
+
+    orbit_size = tail_depth + cycle_length[cycle_id]
+    return {'cycle_id': cycle_id, 'tail_depth': tail_depth,
+            'orbit_size': orbit_size}
+
+
+# Smallest element of the cycle of every element of a permutation
+# (next element of every element)
+# Random marks (1 of MarkRate) cut the cycles into short runs, all walked
+# at the same time. Then pointer jumping over the marks, and over the
+# cycles left without mark (short ones)
+# return int32 array
+def cycle_smallest(next_index, MarkRate=32):
+    count = len(next_index)
+    rng = np.random.default_rng(0)
+    is_mark = rng.random(count) < 1 / MarkRate
+    mark = np.flatnonzero(is_mark).astype(np.int32)
+    owner = np.full(count, -1, dtype=np.int32)  # mark starting the run
+    owner[mark] = np.arange(len(mark), dtype=np.int32)
+    run_min = mark.copy()
+    next_mark = np.empty(len(mark), dtype=np.int32)
+    origin = np.arange(len(mark), dtype=np.int32)
+    walk = next_index[mark]
+    while len(walk):
+        stop = is_mark[walk]
+        next_mark[origin[stop]] = owner[walk[stop]]
+        origin, walk = origin[~stop], walk[~stop]
+        owner[walk] = origin
+        run_min[origin] = np.minimum(run_min[origin], walk)
+        walk = next_index[walk]
+
+    smallest = np.empty(count, dtype=np.int32)
+    marked = owner >= 0
+    smallest[marked] = jump_min(run_min, next_mark)[owner[marked]]
+    rest = np.flatnonzero(~marked).astype(np.int32)
+    position = np.full(count, -1, dtype=np.int32)
+    position[rest] = np.arange(len(rest), dtype=np.int32)
+    smallest[rest] = jump_min(rest, position[next_index[rest]])
+    return smallest
+
+
+# Smallest value over the cycle of every element of a permutation, by
+# pointer jumping (values over 1, 2, 4... elements, until no change)
+def jump_min(values, next_index):
+    for _ in range(max(len(values).bit_length(), 1)):
+        smaller = np.minimum(values, values[next_index])
+        if np.array_equal(smaller, values):
+            break
+        values = smaller
+        next_index = next_index[next_index]
+    return values
+
+
+# Tube around every edge (open ends), as the bevel of a curve would do
+# Each tube is two rings of Segments vertices (one at each end of the
+# edge) linked by Segments quads. Rings are turned as the Z_UP twist of
+# curves : first vertex horizontal, on the side of the edge
+# Edges of no length (vertex linked to itself) have no tube
+# return vertices (float32, (n, 3)) and quad faces (int32, (m, 4))
+def tube_mesh(points, edges, Radius=0.005, Segments=6):
+    keep = edges[:, 0] != edges[:, 1]
+    verts = tube_rings(points[edges[keep, 0]], points[edges[keep, 1]],
+                       Radius, Segments)
+    return verts, tube_faces(int(np.count_nonzero(keep)), Segments)
+
+
+# Vertices of the tubes from p0 to p1 (arrays (n, 3)), two rings by tube
+# A tube of no length is a ring (vertical tube)
+# return vertices (float32, (n * 2 * Segments, 3))
+def tube_rings(p0, p1, Radius=0.005, Segments=6):
+    p0 = p0.astype(np.float64)
+    p1 = p1.astype(np.float64)
+    direction = p1 - p0
+    length = np.linalg.norm(direction, axis=1)
+    direction[length == 0] = (0.0, 0.0, 1.0)
+    length[length == 0] = 1.0
+    direction /= length[:, None]
+
+    # Frame of the rings : u horizontal (x axis for vertical edges)
+    u = np.cross(direction, (0.0, 0.0, 1.0))
+    vertical = np.linalg.norm(u, axis=1) < 1e-9
+    u[vertical] = np.cross(direction[vertical], (1.0, 0.0, 0.0))
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    v = np.cross(direction, u)
+
+    angle = np.arange(Segments) * (math.radians(360) / Segments)
+    ring = (Radius * np.cos(angle)[None, :, None] * u[:, None, :]
+            + Radius * np.sin(angle)[None, :, None] * v[:, None, :])
+    count = len(p0)
+    verts = np.empty((count, 2, Segments, 3), dtype=np.float32)
+    verts[:, 0] = p0[:, None, :] + ring
+    verts[:, 1] = p1[:, None, :] + ring
+    return verts.reshape(-1, 3)
+
+
+# Quad faces of count tubes made by tube_rings, facing out
+# return quad faces (int32, (count * Segments, 4))
+def tube_faces(count, Segments=6):
+    k = np.arange(Segments)
+    k1 = (k + 1) % Segments
+    base = (np.arange(count) * (2 * Segments))[:, None]
+    faces = np.empty((count, Segments, 4), dtype=np.int32)
+    faces[:, :, 0] = base + k
+    faces[:, :, 1] = base + k1
+    faces[:, :, 2] = base + Segments + k1
+    faces[:, :, 3] = base + Segments + k
+    return faces.reshape(-1, 4)
+
+
+# Vertices of the tubes of the graph for any (real) multiplier, the
+# vertices of the graph (points) staying in place
+# Chord i link vertex i to the point at index i * multiplier (modulo),
+# given by points_at(index), i from 1 as modulo_edges
+# return vertices (float32, ((len(points) - 1) * 2 * Segments, 3))
+def sweep_rings(points, points_at, multiplier, Radius=0.005, Segments=6):
+    samples = len(points)
+    i = np.arange(1, samples, dtype=np.float64)
+    return tube_rings(points[1:], points_at((i * multiplier) % samples),
+                      Radius, Segments)
+
+
+# Density image of the chords of the graph seen from above (z axis) :
+# length of chords (pixels) in every pixel, bottom row first
+# Chords are made by chunks of ChunkSize, their points from
+# points_at(index) only. Extent : distance from the center of the image
+# to its borders (graph units)
+# When chords are so many that a pixel is crossed by SamplesPerPixel of
+# them (about), they are sampled every few pixels only (see raster_chords)
+# return float32 array (Height, Width)
+def density_image(Nb_Modulo, TableMulti, points_at, Extent, Width,
+                  Height=None, ChunkSize=1 << 20, SamplesPerPixel=64):
+    image = np.zeros((Height or Width, Width), dtype=np.float32)
+    # Chords are about half the image long
+    Step = max(1.0, Nb_Modulo / (2.0 * image.shape[0] * SamplesPerPixel))
+    rng = np.random.default_rng(0)
+    for start in range(1, Nb_Modulo, ChunkSize):
+        edges = modulo_edges(Nb_Modulo, TableMulti, start,
+                             min(start + ChunkSize, Nb_Modulo))
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        raster_chords(image, points_at(edges[:, 0]), points_at(edges[:, 1]),
+                      Extent, Step, rng)
+    return image
+
+
+# Add chords (lines from p0 to p1, arrays (n, 2 or 3)) into image
+# Ends are moved to the center of their pixel, so chords of the same
+# pixels are drawn once, weighted by their count (most of them when
+# chords are many more than pixels)
+# Lines are sampled every pixel, or every Step pixels from a random
+# offset (rng) : same density on average, when pixels are crossed by many
+# chords (a chord drawn count times is sampled every Step / count pixels)
+# Samples are made by groups of MaxSamples and added tile by tile
+# (TileSize pixels) : memory does not depend on the number of chords nor
+# on the size of the image
+def raster_chords(image, p0, p1, Extent, Step=1.0, rng=None, TileSize=1024,
+                  MaxSamples=1 << 22):
+    Height, Width = image.shape
+    ends = []
+    for p in (p0, p1):
+        x = ((p[:, 0] + Extent) * (Width / (2 * Extent))).astype(np.int64)
+        y = ((p[:, 1] + Extent) * (Height / (2 * Extent))).astype(np.int64)
+        ends += [np.clip(x, 0, Width - 1), np.clip(y, 0, Height - 1)]
+    key = ((ends[0] * Height + ends[1]) * Width + ends[2]) * Height + ends[3]
+    key, count = np.unique(key, return_counts=True)
+    y1 = key % Height
+    x1 = key // Height % Width
+    y0 = key // (Height * Width) % Height
+    x0 = key // (Height * Width * Width)
+    dx = (x1 - x0).astype(np.float64)
+    dy = (y1 - y0).astype(np.float64)
+    length = np.hypot(dx, dy)
+    step = np.maximum(Step / count, 1.0)
+    samples = np.maximum(np.ceil(length / step), 1).astype(np.int64)
+    weight = count * length / samples
+    offset = np.full(len(key), 0.5)
+    if rng is not None and Step > 1:
+        sparse = step > 1
+        offset[sparse] = rng.random(np.count_nonzero(sparse))
+
+    # Sample k of a chord at its origin + k * its increment (pixels)
+    step_x = dx / samples
+    step_y = dy / samples
+    origin_x = x0 + 0.5 + offset * step_x
+    origin_y = y0 + 0.5 + offset * step_y
+
+    # Groups of chords of MaxSamples samples at most (one chord at least)
+    last = np.cumsum(samples)
+    first = 0
+    while first < len(samples):
+        done = last[first] - samples[first]
+        end = max(np.searchsorted(last, done + MaxSamples, 'right'),
+                  first + 1)
+        count = samples[first:end]
+        group = slice(first, end)
+        # Number k of every sample in its chord
+        k = np.arange(last[end - 1] - done, dtype=np.float64)
+        k -= np.repeat(last[group] - count - done, count)
+        x = np.repeat(origin_x[group], count)
+        x += k * np.repeat(step_x[group], count)
+        y = np.repeat(origin_y[group], count)
+        y += k * np.repeat(step_y[group], count)
+        add_tiles(image, x.astype(np.int32), y.astype(np.int32),
+                  np.repeat(weight[group], count), TileSize)
+        first = end
+
+
+# Add weights into the pixels (x, y) of image, tile by tile
+def add_tiles(image, x, y, weights, TileSize=1024):
+    Height, Width = image.shape
+    columns = -(-Width // TileSize)
+    rows = -(-Height // TileSize)
+    tile = (y // TileSize) * columns + x // TileSize
+    if rows * columns <= 1 << 16:
+        tile = tile.astype(np.uint16)  # sorted much faster (radix)
+    order = np.argsort(tile, kind='stable')
+    tile = tile[order]
+    local = (y % TileSize) * TileSize + x % TileSize
+    local, weights = local[order], weights[order]
+    bounds = np.flatnonzero(np.diff(tile)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(tile)]):
+        row, column = divmod(int(tile[start]), columns)
+        top, left = row * TileSize, column * TileSize
+        block = np.bincount(local[start:end], weights[start:end],
+                            minlength=TileSize * TileSize)
+        block = block.reshape(TileSize, TileSize)
+        area = image[top:top + TileSize, left:left + TileSize]
+        area += block[:area.shape[0], :area.shape[1]]
+
+
+# Densities into 0 to 1 (log scale, most dense pixel at 1)
+def tone_map(image):
+    top = float(image.max())
+    if top <= 0:
+        return np.zeros_like(image)
+    return (np.log1p(image) / math.log1p(top)).astype(np.float32)
+
+
+# PNG file (16 bits grayscale) of an image of values from 0 to 1,
+# bottom row first as density_image
+# return the bytes of the file
+def png_image(gray):
+    Height, Width = gray.shape
+    rows = np.empty((Height, 1 + 2 * Width), dtype=np.uint8)
+    rows[:, 0] = 0  # no filter
+    values = np.round(np.clip(gray[::-1], 0, 1) * 65535).astype('>u2')
+    rows[:, 1:] = values.view(np.uint8).reshape(Height, 2 * Width)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    header = struct.pack('>IIBBBBB', Width, Height, 16, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+# Key of a mesh in the cache, from its parameters (a dict)
+def cache_key(params):
+    text = json.dumps(dict(params, GeometryVersion=GeometryVersion),
+                      sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+# Vertices and faces of a mesh from the cache in CacheDir, or made by
+# build() and written into the cache ('' CacheDir for no cache)
+# Arrays read from the cache are memory-mapped (read only)
+# return vertices and faces
+def cached_mesh(CacheDir, params, build, MaxBytes=2 * 1024**3):
+    if not CacheDir:
+        return build()
+    folder = os.path.expanduser(CacheDir)
+    os.makedirs(folder, exist_ok=True)
+    key = cache_key(params)
+    paths = [os.path.join(folder, '%s.%s.npy' % (key, name))
+             for name in ('verts', 'faces')]
+    if all(os.path.isfile(path) for path in paths):
+        for path in paths:
+            os.utime(path)  # last use, for eviction
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+    arrays = build()
+    for path, array in zip(paths, arrays):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, array)
+        os.replace(temp_path, path)
+    evict_cache(folder, MaxBytes, keep=key)
+    return arrays
+
+
+# Remove the least recently used meshes of the cache until all of them
+# take MaxBytes at most (the mesh keep stays, even alone beyond it)
+def evict_cache(folder, MaxBytes, keep=''):
+    entries = {}
+    for name in os.listdir(folder):
+        if not name.endswith('.npy'):
+            continue
+        stat = os.stat(os.path.join(folder, name))
+        key = name.split('.')[0]
+        size, used = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+    total = sum(size for size, used in entries.values())
+    for key, (size, used) in sorted(entries.items(), key=lambda e: e[1][1]):
+        if total <= MaxBytes:
+            break
+        if key == keep:
+            continue
+        for name in ('verts', 'faces'):
+            path = os.path.join(folder, '%s.%s.npy' % (key, name))
+            if os.path.isfile(path):
+                os.remove(path)
+        total -= size